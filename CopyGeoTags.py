@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 """Copy GeoTags from reference photos.
 
 Syntax:
@@ -11,164 +11,375 @@ method    - optional. Interpolation method, e.g., nearest, linear, cubic.
 """
 SupportedFileExt = ['.jpg','.jpeg']
 R = 6400.0e3
+ExifToolTags = [
+    '-EXIF:DateTimeOriginal',
+    '-GPS:GPSLatitudeRef',
+    '-GPS:GPSLatitude',
+    '-GPS:GPSLongitudeRef',
+    '-GPS:GPSLongitude',
+    '-GPS:GPSAltitudeRef',
+    '-GPS:GPSAltitude',
+    '-GPS:GPSTimeStamp',
+    '-GPS:GPSDateStamp'
+]
 import piexif
 import numpy as np
 import sys
 import os
+import json
 from os import path
-from fractions import Fraction
+from shutil import which
+from subprocess import run, PIPE, DEVNULL
+from tempfile import NamedTemporaryFile
+from multiprocessing import cpu_count
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from scipy.interpolate import interp1d
+try:
+    import exifread
+except ImportError:
+    exifread = None
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        return lambda f:f
+
+Epoch = datetime(1970,1,1,0,0,0)
+
+def rational2float(r):
+    return r[0]*1.0/r[1]
+
+@njit(cache=True)
+def dd2dms_batch(dd):
+    """Convert decimal degrees to numerators of (degrees, minutes, seconds) rationals.
+
+Denominators are 1, 1 and 10000 respectively, so seconds are rounded to
+1/10000 and only integer arithmetic is needed.
+"""
+    out = np.empty((dd.size, 3), dtype=np.int64)
+    for i in range(dd.size):
+        total = round(dd[i]*36000000.0)
+        out[i,0] = total // 36000000
+        out[i,1] = total % 36000000 // 600000
+        out[i,2] = total % 600000
+    return out
+
+def list_photos(p):
+    """List supported photos in path p (single file or directory).
+"""
+    if path.isdir(p):
+        with os.scandir(p) as it:
+            return sorted(e.path for e in it if path.splitext(e.name)[1].lower() in SupportedFileExt and e.is_file())
+    elif path.isfile(p):
+        return [p]
+    return []
+
+def piexif_read_tags(f):
+    """Read timestamp and GPS tags of a single photo with piexif.
+
+Tags are returned in the same form as exiftool -n prints them.
+"""
+    d = piexif.load(f)
+    tags = {'SourceFile': f}
+    if 0x9003 in d['Exif']:
+        tags['DateTimeOriginal'] = d['Exif'][0x9003].decode()
+    g = d['GPS']
+    for k, name in [(0x0001, 'GPSLatitudeRef'), (0x0003, 'GPSLongitudeRef'), (0x001d, 'GPSDateStamp')]:
+        if k in g:
+            tags[name] = g[k].decode() if isinstance(g[k], bytes) else g[k]
+    for k, name in [(0x0002, 'GPSLatitude'), (0x0004, 'GPSLongitude')]:
+        if k in g:
+            tags[name] = rational2float(g[k][0]) + rational2float(g[k][1])/60.0 + rational2float(g[k][2])/3600.0
+    if 0x0005 in g:
+        tags['GPSAltitudeRef'] = g[0x0005]
+    if 0x0006 in g:
+        tags['GPSAltitude'] = rational2float(g[0x0006])
+    if 0x0007 in g:
+        tags['GPSTimeStamp'] = ':'.join('{}'.format(rational2float(x)) for x in g[0x0007])
+    return tags
 
-def float2rational(f):
-    F = Fraction(f).limit_denominator()
-    return (F.numerator, F.denominator)
+def exifread_read_tags(f):
+    """Read timestamp and GPS tags of a single photo with exifread.
 
-def dd2dms(dd):
-    mnt, sec = divmod(dd*3600.0, 60)
-    deg, mnt = divmod(mnt, 60)
-    return deg, mnt, sec
+Parsing stops at the GPS date stamp and skips maker notes and thumbnails.
+Tags are returned in the same form as exiftool -n prints them.
+"""
+    with open(f, 'rb') as fp:
+        d = exifread.process_file(fp, details=False, stop_tag='GPSDate')
+    tags = {'SourceFile': f}
+    for k, name in [
+            ('EXIF DateTimeOriginal', 'DateTimeOriginal'),
+            ('GPS GPSLatitudeRef', 'GPSLatitudeRef'),
+            ('GPS GPSLongitudeRef', 'GPSLongitudeRef'),
+            ('GPS GPSDate', 'GPSDateStamp')]:
+        if k in d:
+            tags[name] = str(d[k].values)
+    for k, name in [('GPS GPSLatitude', 'GPSLatitude'), ('GPS GPSLongitude', 'GPSLongitude')]:
+        if k in d:
+            v = [rational2float((x.num, x.den)) for x in d[k].values]
+            tags[name] = v[0] + v[1]/60.0 + v[2]/3600.0
+    if 'GPS GPSAltitudeRef' in d:
+        tags['GPSAltitudeRef'] = d['GPS GPSAltitudeRef'].values[0]
+    if 'GPS GPSAltitude' in d:
+        x = d['GPS GPSAltitude'].values[0]
+        tags['GPSAltitude'] = rational2float((x.num, x.den))
+    if 'GPS GPSTimeStamp' in d:
+        tags['GPSTimeStamp'] = ':'.join('{}'.format(rational2float((x.num, x.den))) for x in d['GPS GPSTimeStamp'].values)
+    return tags
+
+def exiftool_read_tags(files):
+    """Read timestamps and GPS tags of photos with a single exiftool process.
+"""
+    with NamedTemporaryFile('w', suffix='.args') as argfile:
+        argfile.write('\n'.join(files)+'\n')
+        argfile.flush()
+        ## exiftool exits with non-zero status if any file fails, which is
+        ## reported later as missing tags.
+        result = run(['exiftool', '-j', '-n', '-q', *ExifToolTags, '-@', argfile.name], stdout=PIPE, stderr=DEVNULL).stdout
+    return {d['SourceFile']:d for d in json.loads(result.decode() or '[]')}
+
+def batch_read_tags(files):
+    """Read timestamps and GPS tags of all files.
+
+Files are split into chunks and each chunk is read by one exiftool process.
+exifread (or piexif if exifread is not installed) is used instead if exiftool
+is not available, with reads overlapped in a thread pool.
+Returns a dict keyed by file path.
+"""
+    if len(files) == 0:
+        return {}
+    if which('exiftool') is None:
+        if exifread is None:
+            reader = piexif_read_tags
+        else:
+            reader = exifread_read_tags
+        with ThreadPoolExecutor(max_workers=cpu_count()*2) as ex:
+            return dict(zip(files, ex.map(reader, files)))
+    nchunks = min(cpu_count(), len(files))
+    tags = {}
+    with ThreadPoolExecutor(max_workers=nchunks) as ex:
+        for t in ex.map(exiftool_read_tags, [files[i::nchunks] for i in range(nchunks)]):
+            tags.update(t)
+    return tags
+
+def piexif_write_tags(f, tags, latdms, londms):
+    """Write GPS tags to a single photo with piexif.
+
+latdms and londms are numerators returned by dd2dms_batch.
+"""
+    d = piexif.load(f)
+    HH,MM,SS = tags['GPSTimeStamp']
+    d['GPS'] = {
+        piexif.GPSIFD.GPSVersionID: (2,0,0,0),
+        piexif.GPSIFD.GPSLatitudeRef: tags['GPSLatitudeRef'],
+        piexif.GPSIFD.GPSLatitude: ((latdms[0],1),(latdms[1],1),(latdms[2],10000)),
+        piexif.GPSIFD.GPSLongitudeRef: tags['GPSLongitudeRef'],
+        piexif.GPSIFD.GPSLongitude: ((londms[0],1),(londms[1],1),(londms[2],10000)),
+        piexif.GPSIFD.GPSAltitudeRef: tags['GPSAltitudeRef'],
+        piexif.GPSIFD.GPSAltitude: (int(round(tags['GPSAltitude']*1000.0)),1000),
+        piexif.GPSIFD.GPSTimeStamp: ((HH,1),(MM,1),(int(SS*1000+0.5),1000)),
+        piexif.GPSIFD.GPSDateStamp: tags['GPSDateStamp'],
+    }
+    piexif.insert(piexif.dump(d), f)
+
+def exiftool_write_tags(updates):
+    """Write GPS tags to photos with a single exiftool process.
+
+updates is a list of (file, tags) pairs.
+"""
+    with NamedTemporaryFile('w', suffix='.args') as argfile:
+        argfile.write('\n-execute\n'.join('\n'.join([
+            '-q', '-n', '-overwrite_original',
+            '-GPSVersionID=2 0 0 0',
+            '-GPSLatitudeRef={}'.format(tags['GPSLatitudeRef']),
+            '-GPSLatitude={:.8f}'.format(tags['GPSLatitude']),
+            '-GPSLongitudeRef={}'.format(tags['GPSLongitudeRef']),
+            '-GPSLongitude={:.8f}'.format(tags['GPSLongitude']),
+            '-GPSAltitudeRef={:d}'.format(tags['GPSAltitudeRef']),
+            '-GPSAltitude={:.3f}'.format(tags['GPSAltitude']),
+            '-GPSTimeStamp={:d}:{:d}:{:.3f}'.format(*tags['GPSTimeStamp']),
+            '-GPSDateStamp={}'.format(tags['GPSDateStamp']),
+            f
+        ]) for f, tags in updates)+'\n')
+        argfile.flush()
+        run(['exiftool', '-@', argfile.name], check=True, stdout=DEVNULL)
+
+def batch_write_tags(updates):
+    """Write GPS tags to all files.
+
+updates is a list of (file, tags) pairs.
+"""
+    if len(updates) == 0:
+        return
+    if which('exiftool') is None:
+        latdms = dd2dms_batch(np.double([tags['GPSLatitude'] for _, tags in updates])).tolist()
+        londms = dd2dms_batch(np.double([tags['GPSLongitude'] for _, tags in updates])).tolist()
+        for i, (f, tags) in enumerate(updates):
+            piexif_write_tags(f, tags, latdms[i], londms[i])
+        return
+    nchunks = min(cpu_count(), len(updates))
+    with ThreadPoolExecutor(max_workers=nchunks) as ex:
+        list(ex.map(exiftool_write_tags, [updates[i::nchunks] for i in range(nchunks)]))
+
+@njit(cache=True)
+def interp_linear(t, tp, fp):
+    """Linear interpolation of sorted samples (tp, fp) at t, linearly extrapolated
+beyond both ends as interp1d(..., fill_value='extrapolate') does.
+"""
+    i = np.clip(np.searchsorted(tp, t), 1, tp.size-1)
+    return fp[i-1] + (t-tp[i-1])/(tp[i]-tp[i-1])*(fp[i]-fp[i-1])
+
+@njit(cache=True)
+def interp_nearest(t, tp, fp):
+    """Nearest-neighbour interpolation of sorted samples (tp, fp) at t.
+"""
+    i = np.clip(np.searchsorted(tp, t), 1, tp.size-1)
+    return np.where(t-tp[i-1] <= tp[i]-t, fp[i-1], fp[i])
 
 def exiftag2timestamp(exiftag):
     try:
         return (
-            datetime.strptime(exiftag[0x9003].decode(),
-                              r'%Y:%m:%d %H:%M:%S')-
-            datetime.strptime("1970-01-01T00:00:00",
-                              r'%Y-%m-%dT%H:%M:%S')
+            datetime.strptime(exiftag['DateTimeOriginal'],
+                              r'%Y:%m:%d %H:%M:%S')-Epoch
         ).total_seconds()
     except KeyError:
         return None
 
-def geotag2xyzt(geotag):
+def datestamp2timestamp(datestamp):
+    ## YYYY:MM:DD, parsed by hand since strptime is slow.
+    return (
+        datetime(int(datestamp[0:4]), int(datestamp[5:7]), int(datestamp[8:10]))-Epoch
+    ).total_seconds()
+
+def parse_gps(geotag):
+    """Decode GPS tags into signed decimal degrees, signed altitude,
+seconds of day and date stamp.
+"""
     try:
-        latref      = geotag[0x0001]
-        lattuple    = geotag[0x0002]
-        lonref      = geotag[0x0003]
-        lontuple    = geotag[0x0004]
-        altref      = geotag[0x0005]
-        alttuple    = geotag[0x0006]
-        HH,MM,SS    = geotag[0x0007]
-        lat = np.deg2rad(
-            lattuple[0][0]/   1.0/lattuple[0][1]+
-            lattuple[1][0]/  60.0/lattuple[1][1]+
-            lattuple[2][0]/3600.0/lattuple[2][1]
-        )
-        if latref == 'S':
+        lat = geotag['GPSLatitude']
+        if geotag['GPSLatitudeRef'] == 'S':
             lat = 0 - lat
-        lon = np.deg2rad(
-            lontuple[0][0]/   1.0/lontuple[0][1]+
-            lontuple[1][0]/  60.0/lontuple[1][1]+
-            lontuple[2][0]/3600.0/lontuple[2][1]            
-        )
-        if lonref == 'W':
+        lon = geotag['GPSLongitude']
+        if geotag['GPSLongitudeRef'] == 'W':
             lon = 0 - lon
-        alt = alttuple[0]*1.0/alttuple[1]
-        if altref == 1:
+        alt = geotag['GPSAltitude']
+        if geotag['GPSAltitudeRef'] == 1:
             alt = 0 - alt
-        x = np.cos(lon)*np.cos(lat)*(R+alt)
-        y = np.sin(lon)*np.cos(lat)*(R+alt)
-        z = np.sin(lat)*(R+alt)
-        t = HH[0]*3600.0/HH[1] + MM[0]*60.0/MM[1] + SS[0]*1.0/SS[1] + (
-            datetime.strptime(geotag[0x001d],r'%Y:%m:%d')-datetime(1970,1,1,0,0,0)
-        ).total_seconds()
-        return x,y,z,t
+        HH,MM,SS = map(float, str(geotag['GPSTimeStamp']).split(':'))
+        return lat, lon, alt, HH*3600.0 + MM*60.0 + SS, geotag['GPSDateStamp']
     except KeyError:
         return None
 
+def gps_to_xyzt(lat, lon, alt, t):
+    """Convert arrays of geodetic coordinates (in degrees) to cartesian coordinates.
+"""
+    lat = np.deg2rad(lat)
+    lon = np.deg2rad(lon)
+    cl = np.cos(lat)
+    r  = R + alt
+    x  = np.cos(lon)*cl*r
+    y  = np.sin(lon)*cl*r
+    z  = np.sin(lat)*r
+    return x,y,z,t
+
+def xyz_to_gps(x, y, z):
+    """Convert arrays of cartesian coordinates to geodetic coordinates (in degrees).
+"""
+    r = np.sqrt(x*x+y*y+z*z)
+    return np.rad2deg(np.arcsin(z/r)), np.rad2deg(np.arctan2(y,x)), r-R
+
 try:
     method = sys.argv[3]
 except IndexError:
     method = 'nearest'
 
-ts = []
-rs = []
-if path.isdir(sys.argv[1]):
-    for f in os.listdir(sys.argv[1]):
-        if path.splitext(f)[1].lower() in SupportedFileExt:
-            f = path.join(sys.argv[1],f)
-            d = piexif.load(f)
-            t = exiftag2timestamp(d['Exif'])
-            r = geotag2xyzt(d['GPS'])
-            if r is not None:
-                ts.append(t)
-                rs.append(r)
-            else:
-                print('Missing datetime and/or GPS data in {}.'.format(f))
-elif path.isfile(sys.argv[1]):
-    f = sys.argv[1]
-    d = piexif.load(f)
-    t = exiftag2timestamp(d['Exif'])
-    r = geotag2xyzt(d['GPS'])
-    if r is not None:
-        ts.append(t)
-        rs.append(r)
+references = list_photos(sys.argv[1])
+reftags = batch_read_tags(references)
+N = len(references)
+tp = np.empty(N)
+lp = np.empty(N)
+bp = np.empty(N)
+hp = np.empty(N)
+gp = np.empty(N)
+n  = 0
+for f in references:
+    d = reftags.get(f, {})
+    t = exiftag2timestamp(d)
+    g = parse_gps(d)
+    if (t is not None) and (g is not None):
+        tp[n] = t
+        bp[n], lp[n], hp[n], hms, datestamp = g
+        gp[n] = hms + datestamp2timestamp(datestamp)
+        n += 1
     else:
         print('Missing datetime and/or GPS data in {}.'.format(f))
-if len(ts) == 0:
-    raise StandardError('No reference found.')
-elif len(ts) == 1:
-    xfunc = lambda t:rs[0][0]
-    yfunc = lambda t:rs[0][1]
-    zfunc = lambda t:rs[0][2]
-    tfunc = lambda t:t-(ts[0]-rs[0][3])
+if n == 0:
+    raise RuntimeError('No reference found.')
+order = np.argsort(tp[:n])
+tp = tp[order]
+xp, yp, zp, gp = gps_to_xyzt(bp[order], lp[order], hp[order], gp[order])
+op = tp-gp
+if n == 1:
+    xfunc = lambda t:np.full_like(t, xp[0])
+    yfunc = lambda t:np.full_like(t, yp[0])
+    zfunc = lambda t:np.full_like(t, zp[0])
+    tfunc = lambda t:t-op[0]
 else:
-    xfunc = interp1d(np.double(ts), np.double(rs)[:,0], kind=method, bounds_error=False, fill_value='extrapolate')
-    yfunc = interp1d(np.double(ts), np.double(rs)[:,1], kind=method, bounds_error=False, fill_value='extrapolate')
-    zfunc = interp1d(np.double(ts), np.double(rs)[:,2], kind=method, bounds_error=False, fill_value='extrapolate')
-    ofunc = interp1d(np.double(ts), np.double(ts)-np.double(rs)[:,3], kind='nearest', bounds_error=False, fill_value='extrapolate')
+    if method in ['linear', 'nearest']:
+        if method == 'linear':
+            kernel = interp_linear
+        else:
+            kernel = interp_nearest
+        xfunc = lambda t:kernel(t, tp, xp)
+        yfunc = lambda t:kernel(t, tp, yp)
+        zfunc = lambda t:kernel(t, tp, zp)
+        ofunc = lambda t:interp_nearest(t, tp, op)
+    else:
+        xfunc = interp1d(tp, xp, kind=method, bounds_error=False, fill_value='extrapolate', assume_sorted=True)
+        yfunc = interp1d(tp, yp, kind=method, bounds_error=False, fill_value='extrapolate', assume_sorted=True)
+        zfunc = interp1d(tp, zp, kind=method, bounds_error=False, fill_value='extrapolate', assume_sorted=True)
+        ofunc = interp1d(tp, op, kind='nearest', bounds_error=False, fill_value='extrapolate', assume_sorted=True)
     tfunc = lambda t:t-ofunc(t)
 targets = []
-if path.isdir(sys.argv[2]):
-    for f in os.listdir(sys.argv[2]):
-        if path.splitext(f)[1].lower() in SupportedFileExt:
-            targets.append(path.join(sys.argv[2],f))
-elif path.isfile(sys.argv[2]):
-    targets.append(sys.argv[2])
-for f in targets:
-    d = piexif.load(f)
-    t = exiftag2timestamp(d['Exif'])
-    x = xfunc(t)
-    y = yfunc(t)
-    z = zfunc(t)
-    utc = tfunc(t)
-    r = float(sum((x**2.0,y**2.0,z**2.0))**0.5)
-    alt = r-R
-    lat = np.rad2deg(np.arcsin(z/r))
-    lon = np.rad2deg(np.arctan2(y,x))
-    if lat<0:
-        latref = 'S'
-        lat = abs(lat)
-    else:
-        latref = 'N'
-    if lon<0:
-        lonref = 'W'
-        lon = abs(lon)
-    else:
-        lonref = 'E'
-    if alt<0:
-        altref = 1
-        alt = abs(alt)
+tts = []
+photos = list_photos(sys.argv[2])
+tgttags = batch_read_tags(photos)
+for f in photos:
+    t = exiftag2timestamp(tgttags.get(f, {}))
+    if t is None:
+        print('Missing datetime in {}.'.format(f))
     else:
-        altref = 0
-    dd,mm,ss = dd2dms(lon)
-    lontuple = (float2rational(dd),float2rational(mm),float2rational(ss))
-    dd,mm,ss = dd2dms(lat)
-    lattuple = (float2rational(dd),float2rational(mm),float2rational(ss))
-    alttuple = float2rational(alt)
-    dt = datetime.fromtimestamp(utc)
-    timetuple = ((dt.hour,1),(dt.minute,1),(dt.second*1000+dt.microsecond/1000,1000))
-    datestr   = datetime(dt.year,dt.month,dt.day).strftime(r'%Y:%m:%d')
-    gps_ifd = {
-        piexif.GPSIFD.GPSVersionID: (2,0,0,0),
-        piexif.GPSIFD.GPSLatitudeRef: latref,
-        piexif.GPSIFD.GPSLatitude: lattuple,
-        piexif.GPSIFD.GPSLongitudeRef: lonref,
-        piexif.GPSIFD.GPSLongitude: lontuple,
-        piexif.GPSIFD.GPSAltitudeRef: altref,
-        piexif.GPSIFD.GPSAltitude: alttuple,
-        piexif.GPSIFD.GPSTimeStamp: timetuple,
-        piexif.GPSIFD.GPSDateStamp: datestr,
-    }
-    d['GPS'] = gps_ifd
-    piexif.insert(piexif.dump(d), f)
+        targets.append(f)
+        tts.append(t)
+tts  = np.double(tts)
+xs   = xfunc(tts)
+ys   = yfunc(tts)
+zs   = zfunc(tts)
+utcs = tfunc(tts)
+lats, lons, alts = xyz_to_gps(xs, ys, zs)
+latrefs = np.where(lats<0, 'S', 'N').tolist()
+lonrefs = np.where(lons<0, 'W', 'E').tolist()
+altrefs = np.where(alts<0, 1, 0).tolist()
+lats = np.abs(lats).tolist()
+lons = np.abs(lons).tolist()
+alts = np.abs(alts).tolist()
+msecs = np.int64(np.round(utcs*1000.0))
+dates = np.char.replace(np.datetime_as_string(msecs.astype('datetime64[ms]'), unit='D'), '-', ':').tolist()
+msecs = msecs % 86400000
+hours = (msecs // 3600000).tolist()
+mnts  = (msecs // 60000 % 60).tolist()
+secs  = (msecs % 60000 / 1000.0).tolist()
+updates = []
+for i, f in enumerate(targets):
+    updates.append((f, {
+        'GPSLatitudeRef': latrefs[i],
+        'GPSLatitude': lats[i],
+        'GPSLongitudeRef': lonrefs[i],
+        'GPSLongitude': lons[i],
+        'GPSAltitudeRef': altrefs[i],
+        'GPSAltitude': alts[i],
+        'GPSTimeStamp': (hours[i], mnts[i], secs[i]),
+        'GPSDateStamp': dates[i]
+    }))
+batch_write_tags(updates)
@@ -1,7 +1,30 @@
-#!/usr/bin/env python
-import piexif
+#!/usr/bin/env python3
+"""Print GPS tags of the photo.
+
+Syntax:
+python GetGeoTags.py filename
+
+exifread is used if installed, otherwise piexif.
+"""
 import sys
-exif_dict = piexif.load(sys.argv[1])
-for tag in exif_dict["GPS"]:
-    print(tag)
-    print(piexif.TAGS["GPS"][tag]["name"], exif_dict["GPS"][tag])
+try:
+    import exifread
+except ImportError:
+    exifread = None
+    import piexif
+try:
+    filename = sys.argv[1]
+except IndexError:
+    print(__doc__)
+    sys.exit()
+if exifread is None:
+    exif_dict = piexif.load(filename)
+    for tag in exif_dict["GPS"]:
+        print(tag)
+        print(piexif.TAGS["GPS"][tag]["name"], exif_dict["GPS"][tag])
+else:
+    with open(filename, 'rb') as f:
+        tags = exifread.process_file(f, details=False)
+    for tag in tags:
+        if tag.startswith('GPS '):
+            print(tag[4:], tags[tag])
@@ -1,4 +1,11 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
+"""Estimate visual magnitude of NEO(s) of given diameter(s).
+
+Syntax:
+NEOMagnitude.py [diameter[,diameter...]]
+
+diameter - diameter(s) of the NEO in meter, comma separated (Default: 140).
+"""
 import numpy as np
 import sys
 Vsun = -26.74
@@ -7,9 +14,19 @@ Rsun = 1.0                      # Radius of the Earth orbit in AU.
 Rneo = 1.3                      # Radius of the maximum perihelion in AU.
 Albd = 0.13                     # Albedo of the NEO surface.
 AU   = 1.496e11                 # Astromonical Unit in meter.
+K    = np.log10(Albd/(16.0*(Rneo-Rsat)**2.0*(Rneo*AU)**2.0))
+
+def neo_magnitude(Dneo):
+    """Visual magnitude of NEO(s) of diameter(s) Dneo (in meter).
+"""
+    return Vsun-2.5*(2.0*np.log10(np.asarray(Dneo, dtype='float64'))+K)
+
 try:
-    Dneo = eval(sys.argv[1])
-except:
-    Dneo = 140.0                # Diameter of the NEO in meter.
-Vneo = -2.5*np.log10((Albd*(Dneo/(Rneo*AU))**2.0)/(16.0*(Rneo-Rsat)**2.0))+Vsun
-print Vneo
+    Dneo = np.double(sys.argv[1].split(','))
+except (IndexError, ValueError):
+    Dneo = np.double([140.0])   # Diameter of the NEO in meter.
+Vneo = neo_magnitude(Dneo)
+if Vneo.size == 1:
+    print(Vneo[0])
+else:
+    print(Vneo)
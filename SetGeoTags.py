@@ -14,18 +14,18 @@ Author: pigsboss@github
 """
 
 from PIL import Image
-from fractions import Fraction
 import piexif
 import sys
 
-def float2rational(f):
-    F = Fraction(f).limit_denominator()
-    return (F.numerator, F.denominator)
+def dd2dms_rat(dd):
+    """Convert decimal degrees to (degrees, minutes, seconds) rationals.
 
-def dd2dms(dd):
-    mnt, sec = divmod(dd*3600.0, 60)
-    deg, mnt = divmod(mnt, 60)
-    return deg, mnt, sec
+Seconds are rounded to 1/10000 so only integer arithmetic is needed.
+"""
+    total = int(round(dd*36000000.0))
+    deg, rem = divmod(total, 36000000)
+    mnt, sec = divmod(rem, 600000)
+    return ((deg,1),(mnt,1),(sec,10000))
 
 try:
     lat_str  = sys.argv[1]
@@ -47,10 +47,8 @@ else:
     alt_ref = None
     alt_val = None
 
-d,m,s = dd2dms(lon_val)
-lon_tuple = (float2rational(d), float2rational(m), float2rational(s))
-d,m,s = dd2dms(lat_val)
-lat_tuple = (float2rational(d), float2rational(m), float2rational(s))
+lon_tuple = dd2dms_rat(lon_val)
+lat_tuple = dd2dms_rat(lat_val)
 
 exif_dict = piexif.load(filename)
 gps_ifd = {
@@ -62,7 +60,7 @@ gps_ifd = {
 }
 if alt_ref is not None:
     gps_ifd[piexif.GPSIFD.GPSAltitudeRef] = alt_ref
-    gps_ifd[piexif.GPSIFD.GPSAltitude] = float2rational(alt_val)
+    gps_ifd[piexif.GPSIFD.GPSAltitude] = (int(round(alt_val*1000.0)), 1000)
 
 exif_dict["GPS"] = gps_ifd
 exif_bytes = piexif.dump(exif_dict)
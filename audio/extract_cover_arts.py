@@ -12,9 +12,32 @@ Options:
     -i input audio file format(s). Default: all supported formats.
 """
 from getopt import gnu_getopt
-from subprocess import run, PIPE, DEVNULL
+from subprocess import run, DEVNULL
+from concurrent.futures import ThreadPoolExecutor
+from mutagen.flac import FLAC
 import sys, os
 from os import path
+
+def extract(trkpath, outpath):
+    """Extract cover art of audio track trkpath to outpath.
+
+The front cover embedded in FLAC (or its first picture if there is no front
+cover) is written out directly if it is PNG, or converted by ffmpeg otherwise.
+Other formats are left to ffmpeg.
+"""
+    if trkpath.lower().endswith('.flac') and outpath.lower().endswith('.png'):
+        pics = FLAC(trkpath).pictures
+        if len(pics) > 0:
+            pic = next((p for p in pics if p.type == 3), pics[0])
+            if pic.mime == 'image/png':
+                with open(outpath, 'wb') as f:
+                    f.write(pic.data)
+            else:
+                run(["ffmpeg", "-i", "-", "-c:v", "png", outpath], input=pic.data, stdout=DEVNULL, stderr=DEVNULL)
+            return trkpath
+    run(["ffmpeg", "-i", trkpath, "-an", "-c:v", "png", outpath], stdout=DEVNULL, stderr=DEVNULL)
+    return trkpath
+
 opts, args = gnu_getopt(sys.argv[1:], 'hvo:i:')
 verbose = False
 outfile = 'cover.png'
@@ -43,27 +66,20 @@ while not path.exists(srcdir):
 while path.exists(outdir):
     outdir = input(u"{} already exists. Please try again or press [Ctrl-c] to quit: ".format(outdir))
 os.makedirs(outdir)
-args = ['find', srcdir, '-type', 'f']
-for fmt in formats:
-    args += ['-name', '*.{}'.format(fmt), '-or']
-result = run(args[:-1], check=True, stdout=PIPE).stdout
+suffixes = tuple('.{}'.format(fmt.lower()) for fmt in formats)
 albums = dict()
-for trkpath in result.decode().split('\n'):
-    if path.isfile(trkpath):
-        albpath, trkfile = path.split(trkpath)
-        if albpath in albums:
-            albums[albpath] += [trkfile]
-        else:
-            albums[albpath]  = [trkfile]
+for albpath, _, files in os.walk(srcdir):
+    trkfiles = sorted(f for f in files if f.lower().endswith(suffixes))
+    if len(trkfiles) > 0:
+        albums[albpath] = trkfiles
 
+jobs = []
 for alb in albums:
     outpath = path.join(outdir, path.relpath(alb, srcdir))
     os.makedirs(outpath)
-    trkpath = path.join(alb, albums[alb][0])
-    if verbose:
-        sys.stdout.write(u'  Extract from {}......'.format(trkpath))
-        sys.stdout.flush()
-    run(["ffmpeg", "-i", trkpath, "-an", "-c:v", "png", path.join(outpath, outfile)], stdout=DEVNULL, stderr=DEVNULL)
-    if verbose:
-        sys.stdout.write(u'\r  Extract from {}......OK\n'.format(trkpath))
-        sys.stdout.flush()
+    jobs.append((path.join(alb, albums[alb][0]), path.join(outpath, outfile)))
+with ThreadPoolExecutor(max_workers=os.cpu_count()) as ex:
+    for trkpath in ex.map(lambda job:extract(*job), jobs):
+        if verbose:
+            sys.stdout.write(u'  Extract from {}......OK\n'.format(trkpath))
+            sys.stdout.flush()
@@ -9,17 +9,79 @@ import soundfile as sf
 import sys
 from getopt import gnu_getopt
 from os import path
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        return lambda f:f
 
-def analyze_soundfile(filepath, bits=28):
-    data, samplerate = sf.read(filepath, always_2d=True)
-    nframes, nchans = data.shape
-    dmin = np.min(data[:,0])
-    dmax = np.max(data[:,0])
-    x = np.int64((data[:,0]-dmin)/(dmax-dmin)*(2**bits-1)+0.5)
-    cts = np.bincount(x)
-    idx = np.nonzero(cts)
-    pmf = cts[idx] / np.sum(cts)
-    shs = -np.sum(pmf * np.log2(pmf))
+@njit(cache=True)
+def entropy(cts, n):
+    """Entropy in bits of non-zero counts cts of n samples.
+"""
+    pmf = cts / n
+    return -np.sum(pmf * np.log2(pmf))
+
+def merge_counts(parts):
+    """Merge list parts of (values, counts) pairs into distinct sorted values and their counts.
+"""
+    vals = np.concatenate([v for v, _ in parts])
+    cts  = np.concatenate([n for _, n in parts])
+    if len(vals) == 0:
+        return vals, cts
+    i = np.argsort(vals, kind='stable')
+    vals, cts = vals[i], cts[i]
+    edges = np.flatnonzero(np.concatenate(([True], vals[1:] != vals[:-1])))
+    return vals[edges], np.add.reduceat(cts, edges)
+
+def quantize(blk, dmin, scale, buf):
+    """Quantize block of samples blk to unsigned integers through buffer buf.
+
+buf is float64 since float32 does not have enough precision for bits > 24.
+"""
+    np.subtract(blk, dmin, out=buf)
+    np.multiply(buf, scale, out=buf)
+    np.add(buf, 0.5, out=buf)
+    return buf.astype('uint32')
+
+def analyze_soundfile(filepath, bits=28, blocksize=1<<20):
+    with sf.SoundFile(filepath) as f:
+        samplerate = f.samplerate
+        nframes    = f.frames
+        nchans     = f.channels
+        dmin = np.full(nchans,  np.inf)
+        dmax = np.full(nchans, -np.inf)
+        for blk in f.blocks(blocksize=blocksize, dtype='float32', always_2d=True):
+            np.minimum(dmin, np.min(blk, axis=0), out=dmin)
+            np.maximum(dmax, np.max(blk, axis=0), out=dmax)
+        f.seek(0)
+        ## float32 holds PCM samples of up to 24 bits exactly, while the
+        ## quantization buffer stays float64, channel-major.
+        ## constant (e.g. silent) channels are quantized to 0.
+        scale = np.divide(2**bits-1, dmax-dmin, out=np.zeros(nchans), where=dmax>dmin)
+        buf = np.empty((blocksize, nchans), order='F')
+        if (1<<bits) <= nframes:
+            ## dense histogram.
+            cts = np.zeros((nchans, 1<<bits), dtype='int64')
+            for blk in f.blocks(blocksize=blocksize, dtype='float32', always_2d=True):
+                q = quantize(blk, dmin, scale, buf[:len(blk)])
+                for c in range(nchans):
+                    cts[c] += np.bincount(q[:,c], minlength=1<<bits)
+            shs = np.array([entropy(x[x>0], nframes) for x in cts])
+        else:
+            ## sparse histogram of the distinct values of each channel.
+            ## counts of each block are merged into the running histogram
+            ## once they outnumber it, so memory is O(blocksize + distinct
+            ## values), which is bounded by the resolution of the source
+            ## (e.g. 2**24 for 24-bit PCM) rather than by its length.
+            parts = [[(np.empty(0, dtype='uint32'), np.empty(0, dtype='int64'))] for c in range(nchans)]
+            for blk in f.blocks(blocksize=blocksize, dtype='float32', always_2d=True):
+                q = quantize(blk, dmin, scale, buf[:len(blk)])
+                for c in range(nchans):
+                    parts[c].append(merge_counts([(q[:,c], np.ones(len(q), dtype='int64'))]))
+                    if sum(len(v) for v, _ in parts[c][1:]) >= len(parts[c][0][0]):
+                        parts[c] = [merge_counts(parts[c])]
+            shs = np.array([entropy(merge_counts(p)[1], nframes) for p in parts])
     return {
         'path':filepath,
         'samplerate':samplerate,
@@ -34,13 +96,13 @@ def pprint(info_dict, display=True):
         print("Sample rate:        {:d} Hz".format(info_dict['samplerate']))
         print("Frames per channel: {:d}".format(info_dict['nframes']))
         print("Channels:           {:d}".format(info_dict['nchans']))
-        print("Entropy bits:       {:.2f}".format(info_dict['shannons']))
+        print("Entropy bits:       {}".format(', '.join('{:.2f}'.format(x) for x in info_dict['shannons'])))
     else:
-        print("{}: {:d} channels * {:d} Hz * {:.2f} bits".format(
+        print("{}: {:d} channels * {:d} Hz * {} bits".format(
             info_dict['path'],
             info_dict['nchans'],
             info_dict['samplerate'],
-            info_dict['shannons']
+            '/'.join('{:.2f}'.format(x) for x in info_dict['shannons'])
         ))
 
 if __name__ == '__main__':
@@ -56,30 +56,56 @@ Copyright: pigsboss@github
 
 import sys
 import os
+import stat
+import fcntl
 import hashlib
+import mmap
 import signal
 import pickle
+import gzip
+import copy
 import warnings
 import csv
 import shutil
+import socket
+import re
 import unicodedata
 import numpy as np
 from mutagen.mp3 import MP3
 from mutagen.dsf import DSF
 from mutagen.flac import FLAC, Picture
 from mutagen.mp4 import MP4, MP4Cover, MP4FreeForm
-from mutagen.id3 import ID3, APIC, ID3TimeStamp, TextFrame, COMM
+from mutagen.id3 import ID3, APIC, ID3TimeStamp, Frames, COMM
 from mutagen.oggopus import OggOpus
-from multiprocessing import cpu_count, Pool, Process, Queue
-from time import time, sleep
+from multiprocessing import cpu_count, Pool, Value
+from multiprocessing import shared_memory, resource_tracker
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from time import time, sleep, monotonic
 from os import path
 from getopt import gnu_getopt
+from functools import lru_cache, cached_property
 from subprocess import run, Popen, PIPE, DEVNULL, CalledProcessError
-from tempfile import TemporaryDirectory
+from tempfile import TemporaryDirectory, gettempdir
 from mpi4py import MPI
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+try:
+    import msgspec
+    import zstandard
+except ImportError:
+    msgspec = None
 
 comm = MPI.COMM_WORLD
 
+## header of msgpack+zstd library database.
+LIBRARY_MAGIC = b'SLIMDB1\n'
+
 ## Reference:
 ##   https://wiki.hydrogenaud.io/index.php?title=Tag_Mapping
 ##   https://mutagen.readthedocs.io/en/latest/api/vcomment.html#mutagen._vorbis.VCommentDict
@@ -171,6 +197,9 @@ TAG_MAP = {
     }
 }
 
+TAG_MAP_KEYS   = {scheme: frozenset(m)          for scheme, m in TAG_MAP.items()}
+TAG_MAP_VALUES = {scheme: frozenset(m.values()) for scheme, m in TAG_MAP.items()}
+
 PRESETS = {
     'dxd':    {
         'max_sample_rate'     : 384000,
@@ -211,7 +240,9 @@ PRESETS = {
         'format'              :  'M4A',
         'extension'           :  'm4a',
         'art_format'          : 'jpeg',
-        'art_resolution'      :    640
+        'art_resolution'      :    640,
+## bits of precision of SoX resampler, AAC never keeps more than 20 bits.
+        'soxr_precision'      :     20
     },
     'opus': {
         'max_sample_rate'     :  48000,
@@ -227,18 +258,72 @@ PRESETS = {
         'format'              :  'MP3',
         'extension'           :  'mp3',
         'art_format'          : 'jpeg',
-        'art_resolution'      :    200
+        'art_resolution'      :    200,
+        'soxr_precision'      :     16
     }
 }
 
+## audio file extension -> (mutagen class, tagging scheme)
+_LOADERS = {
+    '.dsf'  : (DSF,     'ID3'),
+    '.flac' : (FLAC,    'Vorbis'),
+    '.m4a'  : (MP4,     'MP4'),
+    '.mp3'  : (MP3,     'ID3'),
+    '.opus' : (OggOpus, 'Vorbis')
+}
+
 DEFAULT_CHECKSUM_PROG = 'sha224sum'
+## hash algorithm of internal track and album ids.
+## libraries built before blake2b was introduced use sha224.
+## new libraries use blake2b, blake3 is used only by libraries that recorded it.
+## libraries record their own algorithm and pass it to gen_id explicitly.
+SLIM_ID_ALGO = 'blake2b'
 SAFE_PATH_CHARS = ' _'
+## directory of intermediate files, system temporary directory by default.
+## point SLIM_TMPDIR to a RAM disk to keep intermediate files off disk.
+SLIM_TMPDIR = os.environ.get('SLIM_TMPDIR', gettempdir())
+## presets encoded by ffmpeg alone, tracks of these presets are exported in batches.
+## tracks of lossless presets that need resampling are batched as well.
+FFMPEG_PRESETS = ['aac']
+## presets exported by pipelines of concurrent processes.
+PIPELINE_PRESETS = ['radio', 'opus']
+FFMPEG_BATCH_SIZE = 8
+## threads per ffmpeg process, adjusted by export workers.
+FFMPEG_THREADS = 1
+## kernel buffer size of pipes between pipeline stages, in bytes.
+## Linux caps it at /proc/sys/fs/pipe-max-size for unprivileged users.
+PIPE_SIZE = 1<<20
+## minimum interval between progress updates, in seconds.
+PROGRESS_INTERVAL = 0.1
+_last_progress = 0.0
+
+def gen_id(s, algo=SLIM_ID_ALGO):
+    """Generate track or album id from string s with hash algorithm algo.
+"""
+    if algo == 'blake3':
+        if blake3 is None:
+            raise ImportError('blake3 is required by this library.')
+        return blake3.blake3(s.encode('utf-8')).hexdigest(28)
+    if algo == 'blake2b':
+        return hashlib.blake2b(s.encode('utf-8'), digest_size=28).hexdigest()
+    return hashlib.new(algo, s.encode('utf-8')).hexdigest()
 
 def hostname():
     return run(['hostname','-f'], check=True, stdout=PIPE).stdout.decode().splitlines()[0]
 
+_EAW = None
+
 def nwidechars(s):
-    return sum(unicodedata.east_asian_width(x)=='W' for x in s)
+    """Number of east asian wide characters in s.
+
+A lookup table over all codepoints is built on first call.
+"""
+    global _EAW
+    if _EAW is None:
+        _EAW = np.fromiter(
+            (unicodedata.east_asian_width(chr(i))=='W' for i in range(0x110000)),
+            dtype='uint8', count=0x110000)
+    return int(_EAW[np.frombuffer(s.encode('utf-32-le', 'surrogatepass'), dtype='uint32')].sum())
 
 def width(s):
     return len(s)+nwidechars(s)
@@ -246,6 +331,19 @@ def width(s):
 def uljust(s, w):
     return s.ljust(w-nwidechars(s))
 
+def _progress(prefix, i, n):
+    """Print progress of i out of n tasks.
+
+Updates are throttled to one per PROGRESS_INTERVAL seconds, except the last.
+"""
+    global _last_progress
+    now = monotonic()
+    if i < n and now - _last_progress < PROGRESS_INTERVAL:
+        return
+    _last_progress = now
+    sys.stdout.write(u'\r{}......{:d}/{:d} ({:5.1f}%)'.format(prefix, i, n, 100.0*i/n))
+    sys.stdout.flush()
+
 def wait_file(filepath, timeout=5.0):
     t   = 0.0
     dt  = 0.1
@@ -255,188 +353,232 @@ def wait_file(filepath, timeout=5.0):
         t = time()-tic
     return path.isfile(filepath)
 
-def load_tags(audio_file):
+_TS_RE = re.compile(r'^\s*(\d{4})(?:-\d{2}(?:-\d{2})?)?')
+
+def parse_year(ts):
+    """Parse year from ID3 style timestamp, e.g., 2001 from 2001-02-03.
+"""
+    m = _TS_RE.match(str(ts))
+    if m is None:
+        return str(ID3TimeStamp(ts).year)
+    return m.group(1)
+
+## tags shared by many tracks.
+INTERNED_TAGS = ['albumartist', 'artist', 'album', 'genre', 'composer', 'conductor', 'publisher', 'copyright']
+
+def intern_tags(meta):
+    """Intern string values of INTERNED_TAGS in meta in place, so that tracks
+share the same string objects in memory and in pickles.
+"""
+    for k in INTERNED_TAGS:
+        v = meta.get(k)
+        if isinstance(v, str):
+            meta[k] = sys.intern(v)
+        elif isinstance(v, list):
+            meta[k] = [sys.intern(x) if isinstance(x, str) else x for x in v]
+    return meta
+
+def resolve_format(audio_file):
+    """Return mutagen class and tagging scheme of audio file by its extension.
+"""
+    try:
+        return _LOADERS[path.splitext(audio_file)[1].lower()]
+    except KeyError:
+        raise TypeError(u'unsupported audio file format {}.'.format(audio_file))
+
+def file_fingerprint(filepath):
+    """Fingerprint of file content for caches, i.e., mtime in ns and size.
+"""
+    st = os.stat(filepath)
+    return st.st_mtime_ns, st.st_size
+
+@lru_cache(maxsize=4096)
+def _load_tags_cached(audio_file, mtime, size):
+    """Load tags from audio file, parsed once per mtime and size of the file.
+"""
+    cls, scheme = resolve_format(audio_file)
+    return load_tags(audio_file, audio=cls(audio_file), scheme=scheme)
+
+def load_tags(audio_file, audio=None, scheme=None):
     """Load tags from audio file.
 
+audio and scheme are an already opened mutagen object of audio_file and
+its tagging scheme, if available.
+
 Reference:
 http://age.hobba.nl/audio/mirroredpages/ogg-tagging.html
 
 """
-    if audio_file.lower().endswith('.dsf'):
-        audio = DSF(audio_file)
-        scheme = 'ID3'
-    elif audio_file.lower().endswith('.flac'):
-        audio = FLAC(audio_file)
-        scheme = 'Vorbis'
-    elif audio_file.lower().endswith('.m4a'):
-        audio = MP4(audio_file)
-        scheme = 'MP4'
-    elif audio_file.lower().endswith('.mp3'):
-        audio = MP3(audio_file)
-        scheme ='ID3'
-    elif audio_file.lower().endswith('.opus'):
-        audio = OggOpus(audio_file)
-        scheme = 'Vorbis'
-    else:
-        raise TypeError(u'unsupported audio file format {}.'.format(audio_file))
-    meta = {}
+    if audio is None:
+        ## cached tags are shared, callers get their own copy.
+        return copy.deepcopy(_load_tags_cached(audio_file, *file_fingerprint(audio_file)))
+    meta  = {}
+    tmap  = TAG_MAP[scheme]
+    akeys = TAG_MAP_VALUES[scheme].intersection(audio.keys())
     if scheme == 'ID3':
-        for k in TAG_MAP[scheme]:
-            if TAG_MAP[scheme][k] in audio.keys():
+        for k, tag in tmap.items():
+            if tag in akeys:
+                v = audio[tag]
                 if k == 'date':
-                    meta[k] = audio[TAG_MAP[scheme][k]][0].get_text()
+                    meta[k] = v[0].get_text()
                 elif k == 'discnumber':
                     try:
-                        meta[k], meta['totaldiscs'] = map(int, audio[TAG_MAP[scheme][k]][0].split('/'))
+                        meta[k], meta['totaldiscs'] = map(int, v[0].split('/'))
                     except ValueError:
-                        meta[k] = int(audio[TAG_MAP[scheme][k]][0])
+                        meta[k] = int(v[0])
                         meta['totaldiscs'] = 0
                 elif k == 'tracknumber':
                     try:
-                        meta[k], meta['totaltracks'] = map(int, audio[TAG_MAP[scheme][k]][0].split('/'))
+                        meta[k], meta['totaltracks'] = map(int, v[0].split('/'))
                     except ValueError:
-                        meta[k] = int(audio[TAG_MAP[scheme][k]][0])
+                        meta[k] = int(v[0])
                         meta['totaltracks'] = 0
                 elif k == 'year':
-                    meta[k] = str(ID3TimeStamp(audio[TAG_MAP[scheme][k]][0]).year)
+                    meta[k] = parse_year(v[0])
                     if 'date' not in meta:
-                        meta['date'] = ID3TimeStamp(audio[TAG_MAP[scheme][k]][0]).get_text()
+                        meta['date'] = str(v[0])
                 elif k == 'compilation':
-                    meta[k] = bool(int(audio[TAG_MAP[scheme][k]][0]))
+                    meta[k] = bool(int(v[0]))
                 elif k == 'genre':
-                    meta[k] = audio[TAG_MAP[scheme][k]].genres
+                    meta[k] = v.genres
                 else:
-                    meta[k] = audio[TAG_MAP[scheme][k]].text[0]
+                    meta[k] = v.text[0]
             if k == 'comment':
                 meta[k] = []
                 for kk in audio.keys():
                     if kk.lower().startswith('comm'):
                         meta[k] += audio[kk].text
     elif scheme == 'MP4':
-        for k in TAG_MAP[scheme]:
-            if TAG_MAP[scheme][k] in audio.keys():
+        for k, tag in tmap.items():
+            if tag in akeys:
+                v = audio[tag]
                 if k == 'date':
-                    meta[k] = audio[TAG_MAP[scheme][k]][0]
-                    meta['year'] = str(ID3TimeStamp(meta['date']).year)
+                    meta[k] = v[0]
+                    meta['year'] = parse_year(meta['date'])
                 elif k == 'discnumber':
                     try:
-                        meta[k], meta['totaldiscs'] = audio[TAG_MAP[scheme][k]][0]
+                        meta[k], meta['totaldiscs'] = v[0]
                     except ValueError:
-                        meta[k] = audio[TAG_MAP[scheme][k]][0]
+                        meta[k] = v[0]
                         meta['totaldiscs'] = 0
                 elif k == 'tracknumber':
                     try:
-                        meta[k], meta['totaltracks'] = audio[TAG_MAP[scheme][k]][0]
+                        meta[k], meta['totaltracks'] = v[0]
                     except ValueError:
-                        meta[k] = audio[TAG_MAP[scheme][k]][0]
+                        meta[k] = v[0]
                         meta['totaltracks'] = 0
                 elif k == 'year':
-                    meta[k] = str(ID3TimeStamp(audio[TAG_MAP[scheme][k]][0]).year)
+                    meta[k] = parse_year(v[0])
                     if 'date' not in meta:
-                        meta['date'] = ID3TimeStamp(audio[TAG_MAP[scheme][k]][0]).get_text()
+                        meta['date'] = str(v[0])
                 elif k == 'compilation':
-                    meta[k] = bool(int(audio[TAG_MAP[scheme][k]][0]))
-                elif TAG_MAP[scheme][k].startswith('----'):
+                    meta[k] = bool(int(v[0]))
+                elif tag.startswith('----'):
                     ## MP4 freeform keys start with '----' and only accept bytearray instead of str.
-                    meta[k] = list(map(MP4FreeForm.decode, audio[TAG_MAP[scheme][k]]))
+                    meta[k] = list(map(MP4FreeForm.decode, v))
                 else:
-                    meta[k] = audio[TAG_MAP[scheme][k]][0]
+                    meta[k] = v[0]
     elif scheme == 'Vorbis':
-        for k in TAG_MAP[scheme]:
-            if TAG_MAP[scheme][k] in audio.keys():
+        for k, tag in tmap.items():
+            if tag in akeys:
+                v = audio[tag]
                 if k == 'date':
-                    meta[k] = audio[TAG_MAP[scheme][k]][0]
-                    meta['year'] = str(ID3TimeStamp(meta['date']).year)
+                    meta[k] = v[0]
+                    meta['year'] = parse_year(meta['date'])
                 elif k == 'discnumber':
                     try:
-                        meta[k], meta['totaldiscs'] = map(int, audio[TAG_MAP[scheme][k]][0].split('/'))
+                        meta[k], meta['totaldiscs'] = map(int, v[0].split('/'))
                     except ValueError:
-                        meta[k] = int(audio[TAG_MAP[scheme][k]][0])
+                        meta[k] = int(v[0])
                         meta['totaldiscs'] = 0
                 elif k == 'tracknumber':
                     try:
-                        meta[k], meta['totaltracks'] = map(int, audio[TAG_MAP[scheme][k]][0].split('/'))
+                        meta[k], meta['totaltracks'] = map(int, v[0].split('/'))
                     except ValueError:
-                        meta[k] = int(audio[TAG_MAP[scheme][k]][0])
+                        meta[k] = int(v[0])
                         meta['totaltracks'] = 0
                 elif k in ['totaldiscs', 'disctotal']:
-                    meta['totaldiscs'] = int(audio[TAG_MAP[scheme][k]][0])
+                    meta['totaldiscs'] = int(v[0])
                 elif k in ['totaltracks', 'tracktotal']:
-                    meta['totaltracks'] = int(audio[TAG_MAP[scheme][k]][0])
+                    meta['totaltracks'] = int(v[0])
                 elif k == 'year':
-                    meta[k] = str(ID3TimeStamp(audio[TAG_MAP[scheme][k]][0]).year)
+                    meta[k] = parse_year(v[0])
                     if 'date' not in meta:
-                        meta['date'] = ID3TimeStamp(audio[TAG_MAP[scheme][k]][0]).get_text()
+                        meta['date'] = str(v[0])
                 elif k == 'compilation':
                     meta[k] = False
-                    if len(audio[TAG_MAP[scheme][k]][0]) > 0:
+                    if len(v[0]) > 0:
                         try:
-                            meta[k] = bool(int(audio[TAG_MAP[scheme][k]][0]))
+                            meta[k] = bool(int(v[0]))
                         except ValueError:
                             meta[k] = True
                 else:
-                    meta[k] = audio[TAG_MAP[scheme][k]][0]
+                    meta[k] = v[0]
     return meta
 
+def _id3_texts(v):
+    """Text list of ID3 frame from tag value v, a single value or a list.
+"""
+    if isinstance(v, (list, tuple)):
+        return [str(x) for x in v]
+    return [str(v)]
+
+def _id3_text(k):
+    frame = Frames[TAG_MAP['ID3'][k]]
+    return lambda v, meta: frame(encoding=3, text=_id3_texts(v))
+
+def _id3_number(k):
+    frame = Frames[TAG_MAP['ID3'][k]]
+    total = 'total{}s'.format(k[:-6])
+    return lambda v, meta: frame(encoding=3, text=[
+        '{:d}/{:d}'.format(v, meta[total]) if meta.get(total, 0) > 0 else '{:d}'.format(v)
+    ])
+
+## tag value converters of save_tags, tag key -> f(value, meta), per scheme.
+_TAG_WRITERS = {
+    'ID3': dict(
+        {k:_id3_text(k) for k in TAG_MAP['ID3']},
+        date        = lambda v, meta:Frames['TDRC'](encoding=3, text=[ID3TimeStamp(v)]),
+        discnumber  = _id3_number('discnumber'),
+        tracknumber = _id3_number('tracknumber'),
+        compilation = lambda v, meta:Frames['TCMP'](encoding=3, text=[str(int(v))]),
+        comment     = lambda v, meta:COMM(encoding=3, lang='eng', desc='', text=_id3_texts(v))
+    ),
+    'MP4': dict(
+        {k:(
+            (lambda v, meta:[MP4FreeForm(x.encode('utf-8')) for x in v]) if tag.startswith('----') else
+            (lambda v, meta:v)
+        ) for k, tag in TAG_MAP['MP4'].items()},
+        discnumber  = lambda v, meta:[(v, meta.get('totaldiscs', 0))],
+        tracknumber = lambda v, meta:[(v, meta.get('totaltracks', 0))],
+        compilation = lambda v, meta:int(v)
+    ),
+    'Vorbis': dict(
+        {k:(lambda v, meta:v) for k in TAG_MAP['Vorbis']},
+        **{k:(lambda v, meta:'{:d}'.format(int(v))) for k in [
+            'discnumber', 'tracknumber', 'totaldiscs', 'totaltracks', 'disctotal', 'tracktotal', 'compilation'
+        ] if k in TAG_MAP['Vorbis']}
+    )
+}
+
 def save_tags(meta, audio_file):
     """Save metadata to specified audio file.
 """
-    if audio_file.lower().endswith('.dsf'):
-        audio = DSF(audio_file)
-        scheme = 'ID3'
-    elif audio_file.lower().endswith('.flac'):
-        audio = FLAC(audio_file)
-        scheme = 'Vorbis'
-    elif audio_file.lower().endswith('.m4a'):
-        audio = MP4(audio_file)
-        scheme = 'MP4'
-    elif audio_file.lower().endswith('.mp3'):
-        audio = MP3(audio_file)
-        scheme ='ID3'
-    elif audio_file.lower().endswith('.opus'):
-        audio = OggOpus(audio_file)
-        scheme = 'Vorbis'
-    else:
-        raise TypeError(u'unsupported audio file format {}.'.format(audio_file))
-    if scheme == 'ID3':
-        for k in meta:
-            if k in TAG_MAP[scheme]:
-                if k == 'date':
-                    audio[TAG_MAP[scheme][k]] = TextFrame(encoding=3, text=[ID3TimeStamp(meta[k])])
-                elif k == 'discnumber':
-                    if meta['totaldiscs'] > 0:
-                        audio[TAG_MAP[scheme][k]] = TextFrame(encoding=3, text=['{:d}/{:d}'.format(meta[k], meta['totaldiscs'])])
-                    else:
-                        audio[TAG_MAP[scheme][k]] = TextFrame(encoding=3, text=['{:d}'.format(meta[k])])
-                elif k == 'tracknumber':
-                    if meta['totaltracks'] > 0:
-                        audio[TAG_MAP[scheme][k]] = TextFrame(encoding=3, text=['{:d}/{:d}'.format(meta[k], meta['totaltracks'])])
-                    else:
-                        audio[TAG_MAP[scheme][k]] = TextFrame(encoding=3, text=['{:d}'.format(meta[k])])
-                elif k == 'compilation':
-                    audio[TAG_MAP[scheme][k]] = TextFrame(encoding=3, text=[str(int(meta[k]))])
-                else:
-                    audio[TAG_MAP[scheme][k]] = TextFrame(encoding=3, text=[meta[k]])
-    elif scheme == 'MP4':
-        for k in meta:
-            if k in TAG_MAP[scheme]:
-                if k == 'discnumber':
-                    audio[TAG_MAP[scheme][k]] = [(meta[k], meta['totaldiscs'])]
-                elif k == 'tracknumber':
-                    audio[TAG_MAP[scheme][k]] = [(meta[k], meta['totaltracks'])]
-                elif k == 'compilation':
-                    audio[TAG_MAP[scheme][k]] = int(meta[k])
-                elif TAG_MAP[scheme][k].startswith('----'):
-                    audio[TAG_MAP[scheme][k]] = list(map(lambda x:MP4FreeForm(x.encode('utf-8')), meta[k]))
-                else:
-                    audio[TAG_MAP[scheme][k]] = meta[k]
-    elif scheme == 'Vorbis':
-        for k in meta:
-            if k in TAG_MAP[scheme]:
-                if k in ['discnumber', 'tracknumber', 'totaldiscs', 'totaldracks', 'compilation']:
-                    audio[TAG_MAP[scheme][k]] = '{:d}'.format(int(meta[k]))
-                else:
-                    audio[TAG_MAP[scheme][k]] = meta[k]
+    cls, scheme = resolve_format(audio_file)
+    audio = cls(audio_file)
+    tmap  = TAG_MAP[scheme]
+    conv  = _TAG_WRITERS[scheme]
+    if audio.tags is None:
+        audio.add_tags()
+    for k, v in meta.items():
+        f = conv.get(k)
+        if f is None:
+            continue
+        if scheme == 'ID3':
+            ## ID3 frames are keyed by their HashKey, e.g., COMM::eng.
+            audio.tags.setall(tmap[k], [f(v, meta)])
+        else:
+            audio[tmap[k]] = f(v, meta)
     audio.save()
 
 def copy_tags(src, dest, keys=None):
@@ -449,51 +591,92 @@ def copy_tags(src, dest, keys=None):
         tags = meta
     save_tags(tags, dest)
 
+class _PathTable(dict):
+    """Translation table of genpath, filled once per code point seen.
+"""
+    def __missing__(self, cp):
+        c = chr(cp)
+        v = cp if (c.isalpha() or c.isdigit() or c in SAFE_PATH_CHARS) else ord('_')
+        self[cp] = v
+        return v
+
+_PATH_TABLE = _PathTable()
+
 def genpath(s):
     """Generate valid path from input string.
 """
-    p = ''
-    for x in s:
-        if x.isalpha() or x.isdigit() or x in SAFE_PATH_CHARS:
-            p+=x
-        else:
-            p+='_'
-    return p.strip()
+    return s.translate(_PATH_TABLE).strip()
+
+@lru_cache(maxsize=64)
+def _load_cover(picture_file, size, mtime):
+    """Content of cover art picture file, cached by (path, size, mtime).
+"""
+    with open(picture_file, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            return m[:]
+
+def load_cover(picture_file):
+    """Read cover art picture file, once for all tracks of an album.
+"""
+    st = os.stat(picture_file)
+    return _load_cover(picture_file, st.st_size, st.st_mtime_ns)
 
 def add_cover_art(audio_file, picture_file):
-    if audio_file.lower().endswith('.flac'):
+    data = load_cover(picture_file)
+    ext = path.splitext(audio_file)[1].lower()
+    if ext == '.flac':
         metadata = FLAC(audio_file)
         coverart = Picture()
         coverart.type = 3
         if picture_file.lower().endswith('.png'):
-            mime = 'image/png'
+            coverart.mime = 'image/png'
         else:
-            mime = 'image/jpeg'
+            coverart.mime = 'image/jpeg'
         coverart.desc = 'front cover'
-        with open(picture_file, 'rb') as f:
-            coverart.date = f.read()
+        coverart.data = data
         metadata.add_picture(coverart)
-    elif audio_file.endswith('.m4a'):
+    elif ext == '.m4a':
         metadata = MP4(audio_file)
-        with open(picture_file, 'rb') as f:
-            if picture_file.lower().endswith('.png'):
-                metadata['covr'] = [MP4Cover(f.read(), imageformat=MP4Cover.FORMAT_PNG)]
-            else:
-                metadata['covr'] = [MP4Cover(f.read(), imageformat=MP4Cover.FORMAT_JPEG)]
-    elif audio_file.endswith('.mp3'):
+        if picture_file.lower().endswith('.png'):
+            metadata['covr'] = [MP4Cover(data, imageformat=MP4Cover.FORMAT_PNG)]
+        else:
+            metadata['covr'] = [MP4Cover(data, imageformat=MP4Cover.FORMAT_JPEG)]
+    elif ext == '.mp3':
         metadata = ID3(audio_file)
-        with open(picture_file, 'rb') as f:
-            metadata['APIC'] = APIC(
-                encoding=3,
-                mime='image/jpeg',
-                type=3,
-                desc=u'Cover',
-                data=f.read()
-            )
+        metadata['APIC'] = APIC(
+            encoding=3,
+            mime='image/jpeg',
+            type=3,
+            desc=u'Cover',
+            data=data
+        )
     else:
         assert False, 'unsupported audio file format.'
     metadata.save()
 
+def resize_cover_art(src, dst, fmt, resolution=None):
+    """Convert cover art picture to specified format, shrinking it to fit
+resolution x resolution if resolution is not None.
+"""
+    if Image is None:
+        if resolution is None:
+            args = ['convert', src, dst]
+        else:
+            args = ['convert', src, '-resize', '{:d}x{:d}>'.format(resolution, resolution), dst]
+        run(args, check=True, stdout=DEVNULL, stderr=DEVNULL)
+        return dst
+    with Image.open(src) as img:
+        if resolution is not None:
+            img.thumbnail((resolution, resolution), Image.LANCZOS)
+        if fmt.lower() in ['jpeg', 'jpg']:
+            img.convert('RGB').save(dst, 'JPEG', quality=92, optimize=True)
+        else:
+            img.save(dst, fmt.upper(), optimize=True)
+    return dst
+
+_CHECKSUM_PROG_RE = re.compile(r'^source checksum program:[ \t]*([^:\n]*?)[ \t]*(?::|$)', re.I|re.M)
+_CHECKSUM_RE      = re.compile(r'^source file checksum:[ \t]*([^:\n]*?)[ \t]*(?::|$)', re.I|re.M)
+
 def get_source_file_checksum(audio_file):
     prog = None
     csum = None
@@ -502,112 +685,223 @@ def get_source_file_checksum(audio_file):
         cmts = tags['comment']
         if isinstance(cmts, list):
             cmts = '\n'.join(cmts)
-        for cmt in cmts.splitlines():
-            if cmt.lower().startswith('source checksum program:'):
-                prog = cmt.split(':')[1].strip()
-            elif cmt.lower().startswith('source file checksum:'):
-                csum = cmt.split(':')[1].strip()
+        ## checksums are appended on re-export, the last one is current.
+        m = _CHECKSUM_PROG_RE.findall(cmts)
+        if m:
+            prog = m[-1]
+        m = _CHECKSUM_RE.findall(cmts)
+        if m:
+            csum = m[-1]
     return {'program': prog, 'checksum': csum}
 
+@lru_cache(maxsize=4096)
+def _cached_dest_checksum(audio_file, mtime, size):
+    """Source file checksum recorded in exported audio file, cached by path
+and file_fingerprint.
+"""
+    return get_source_file_checksum(audio_file)
+
 def set_source_file_checksum(audio_file, csum, program=DEFAULT_CHECKSUM_PROG):
-    if  audio_file.lower().endswith('.flac'):
-        metadata = FLAC(audio_file)
-        scheme = 'Vorbis'
-    elif audio_file.lower().endswith('.opus'):
-        metadata = OggOpus(audio_file)
-        scheme = 'Vorbis'
-    elif audio_file.lower().endswith('.dsf'):
-        metadata = DSF(audio_file)
-        scheme = 'ID3'
-    elif audio_file.lower().endswith('.mp3'):
-        metadata = MP3(audio_file)
-        scheme = 'ID3'
-    elif audio_file.lower().endswith('.m4a'):
-        metadata = MP4(audio_file)
-        scheme = 'MP4'
-    else:
-        raise TypeError(u'unsupported audio format {}.'.format(audio_file))
+    cls, scheme = resolve_format(audio_file)
+    metadata = cls(audio_file)
+    tag = TAG_MAP[scheme]['comment']
     if scheme=='ID3':
-        if TAG_MAP[scheme]['comment'] in metadata.tags.keys():
-            metadata.tags[TAG_MAP[scheme]['comment']] = COMM(encoding=3, text=['\n'.join([
-                metadata.tags[TAG_MAP[scheme]['comment']][0],
+        if tag in metadata.tags.keys():
+            metadata.tags[tag] = COMM(encoding=3, text=['\n'.join([
+                metadata.tags[tag][0],
                 u'Source Checksum Program: {}'.format(program),
                 u'Source File Checksum: {}'.format(csum)])])
         else:
-            metadata.tags[TAG_MAP[scheme]['comment']] = COMM(encoding=3, text=['\n'.join([
+            metadata.tags[tag] = COMM(encoding=3, text=['\n'.join([
                 u'Source Checksum Program: {}'.format(program),
                 u'Source File Checksum: {}'.format(csum)])])
     else:
-        if TAG_MAP[scheme]['comment'] in metadata.tags.keys():
-            if isinstance(metadata.tags[TAG_MAP[scheme]['comment']], str):
+        if tag in metadata.tags.keys():
+            if isinstance(metadata.tags[tag], str):
                 cmt = '\n'.join([
-                    metadata.tags[TAG_MAP[scheme]['comment']],
+                    metadata.tags[tag],
                     u'Source Checksum Program: {}'.format(program),
                     u'Source File Checksum: {}'.format(csum)
                 ])
-            elif isinstance(metadata.tags[TAG_MAP[scheme]['comment']], list):
+            elif isinstance(metadata.tags[tag], list):
                 cmt = '\n'.join([
-                    '\n'.join(metadata.tags[TAG_MAP[scheme]['comment']]),
+                    '\n'.join(metadata.tags[tag]),
                     u'Source Checksum Program: {}'.format(program),
                     u'Source File Checksum: {}'.format(csum)
                 ])
             else:
                 raise TypeError(u'target tag is neither str nor list.')
-            metadata.tags[TAG_MAP[scheme]['comment']] = cmt
+            metadata.tags[tag] = cmt
         else:
-            metadata.tags[TAG_MAP[scheme]['comment']] = '\n'.join([
+            metadata.tags[tag] = '\n'.join([
                 u'Source Checksum Program: {}'.format(program),
                 u'Source File Checksum: {}'.format(csum)])
     metadata.save()
 
+def _hash_file(filepath, algo='sha224', chunk=1<<20):
+    """Calculate checksum of file with Linux kernel crypto API (AF_ALG) if it
+provides algo, otherwise with hashlib.
+
+Both release the GIL on large buffers, so this runs in parallel threads.
+"""
+    if _afalg_available(algo):
+        return afalg_checksum(filepath, algo, chunk)
+    h   = hashlib.new(algo)
+    buf = bytearray(chunk)
+    mv  = memoryview(buf)
+    with open(filepath, 'rb', buffering=0) as f:
+        try:
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        except AttributeError:
+            pass
+        n = f.readinto(buf)
+        while n:
+            h.update(mv[:n])
+            n = f.readinto(buf)
+    return h.hexdigest()
+
+@lru_cache(maxsize=None)
+def _afalg_available(algo):
+    """Check if Linux kernel crypto API (AF_ALG) provides hash algorithm algo,
+once per process.
+"""
+    try:
+        hashlib.new(algo)
+        with socket.socket(socket.AF_ALG, socket.SOCK_SEQPACKET, 0) as alg:
+            alg.bind(('hash', algo))
+    except (AttributeError, OSError, ValueError):
+        return False
+    return True
+
+def afalg_checksum(filepath, algo, chunk=1<<20):
+    """Calculate checksum of file with Linux kernel crypto API (AF_ALG).
+
+Raises AttributeError or OSError if AF_ALG or the algorithm is not available.
+"""
+    buf = bytearray(chunk)
+    mv  = memoryview(buf)
+    with socket.socket(socket.AF_ALG, socket.SOCK_SEQPACKET, 0) as alg:
+        alg.bind(('hash', algo))
+        op, _ = alg.accept()
+        with op, open(filepath, 'rb', buffering=0) as f:
+            try:
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            except AttributeError:
+                pass
+            n = f.readinto(buf)
+            while n:
+                op.sendall(mv[:n], socket.MSG_MORE)
+                n = f.readinto(buf)
+            op.send(b'')
+            return op.recv(hashlib.new(algo).digest_size).hex()
+
+def run_pipeline(*cmds):
+    """Run commands as a pipeline, i.e., cmds[0] | cmds[1] | ... | cmds[-1].
+
+All stages run concurrently and pass data through kernel pipes.
+Parent-side pipe ends are closed so that an early exit of a downstream
+stage terminates the upstream ones.
+CalledProcessError is raised if any stage fails.
+"""
+    procs = []
+    stdin = None
+    for i, cmd in enumerate(cmds):
+        if i < len(cmds)-1:
+            r, w = os.pipe()
+            ## larger kernel pipe buffer, fewer context switches between stages.
+            try:
+                fcntl.fcntl(w, fcntl.F_SETPIPE_SZ, PIPE_SIZE)
+            except (AttributeError, OSError):
+                pass
+        else:
+            r, w = None, DEVNULL
+        p = Popen(cmd, stdin=stdin, stdout=w, stderr=DEVNULL)
+        if stdin is not None:
+            os.close(stdin)
+        if r is not None:
+            os.close(w)
+        stdin = r
+        procs.append(p)
+    for p, cmd in zip(procs[::-1], cmds[::-1]):
+        if p.wait() != 0:
+            raise CalledProcessError(p.returncode, cmd)
+
 def find_tracks(srcdir):
     """Find all SONY Music tracks (*.flac and *.dsf).
 """
-    result = run([
-        'find', path.abspath(srcdir), '-type', 'f',
-        '-iname', '*.flac', '-or', '-iname', '*.dsf'
-    ], check=True, stdout=PIPE, stderr=DEVNULL)
+    exts   = ('.flac', '.dsf')
+    stack  = [path.normpath(path.abspath(srcdir))]
     tracks = []
-    for p in result.stdout.decode().splitlines():
-        if path.isfile(path.normpath(path.abspath(p))):
-            tracks.append(path.normpath(path.abspath(p)))
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for e in it:
+                    if e.is_dir(follow_symlinks=False):
+                        stack.append(e.path)
+                    elif e.name.lower().endswith(exts) and e.is_file(follow_symlinks=False):
+                        tracks.append(e.path)
+        except OSError:
+            pass
     return tracks
 
+## opusenc has dedicated options for these tags.
+_OPUS_TAGOPTS = {k:'--{}'.format(k) for k in ['title', 'artist', 'album', 'tracknumber', 'date', 'genre']}
+
+## upper case Vorbis comment field names.
+_VORBIS_FIELDS = {k:v.upper() for k, v in TAG_MAP['Vorbis'].items()}
+_VORBIS_FIELDS_OPUS = dict(_VORBIS_FIELDS, comment='comment')
+
 def gen_opus_tagopts(tags):
     """Generate opusenc metadata options.
 """
-    opts = []
-    for k in tags:
-        if k in ['title', 'artist', 'album', 'tracknumber', 'date', 'genre']:
-            opts += ['--{}'.format(k), '{}'.format(tags[k])]
-        elif k == 'comment':
-            opts += ['--comment', '{}={}'.format('comment', tags[k])]
-        elif k in TAG_MAP['Vorbis']:
-            opts += ['--comment', '{}={}'.format(k.upper(), tags[k])]
-    return opts
-
-def gen_flac_tagopts(tags):
-    """Generate FLAC Tagging options.
+    return [opt for k, v in tags.items() if k in _VORBIS_FIELDS_OPUS for opt in (
+        (_OPUS_TAGOPTS[k], '{}'.format(v)) if k in _OPUS_TAGOPTS else
+        ('--comment', '{}={}'.format(_VORBIS_FIELDS_OPUS[k], v))
+    )]
+
+def set_flac_tags(audio_file, tags, picture_file=None):
+    """Set FLAC Vorbis comments and front cover with a single save.
 """
-    opts = []
-    for k in tags:
-        if k in TAG_MAP['Vorbis']:
-            if isinstance(tags[k], list):
-                for opt in [['-T', '{}={}'.format(TAG_MAP['Vorbis'][k].upper(), v)] for v in tags[k]]:
-                    opts += opt
+    tmap = TAG_MAP['Vorbis']
+    metadata = FLAC(audio_file)
+    for k, v in tags.items():
+        if k in TAG_MAP_KEYS['Vorbis']:
+            if isinstance(v, list):
+                metadata[tmap[k].upper()] = ['{}'.format(x) for x in v]
             else:
-                opts += ['-T', '{}={}'.format(TAG_MAP['Vorbis'][k].upper(), tags[k])]
-    return opts
+                metadata[tmap[k].upper()] = '{}'.format(v)
+    if picture_file is not None:
+        coverart = Picture()
+        coverart.type = 3
+        if picture_file.lower().endswith('.png'):
+            coverart.mime = 'image/png'
+        else:
+            coverart.mime = 'image/jpeg'
+        coverart.desc = 'Cover'
+        coverart.data = load_cover(picture_file)
+        metadata.add_picture(coverart)
+    metadata.save()
+
+def stamp_path(filepath):
+    """Path of export stamp sidecar of exported audio file.
+"""
+    parent, name = path.split(filepath)
+    return path.join(parent, '.{}.slim-stamp'.format(name))
 
 class AudioTrack(object):
-    def __init__(self, filepath, checksum=True):
+    def __init__(self, filepath, checksum=True, id_algo=SLIM_ID_ALGO):
         ## examine path
-        if not path.isfile(filepath):
-            raise FileNotFoundError(u'Audio track file does not exist.'.format(filepath))
         self.source = path.normpath(path.abspath(filepath))
+        try:
+            st = os.stat(self.source)
+        except FileNotFoundError:
+            st = None
+        if st is None or not stat.S_ISREG(st.st_mode):
+            raise FileNotFoundError(u'Audio track file {} does not exist.'.format(filepath))
         self.file = {
-            'size'  : path.getsize(self.source),
-            'ctime' : path.getctime(self.source)
+            'size'  : st.st_size,
+            'ctime' : st.st_ctime,
+            'mtime' : st.st_mtime_ns
         }
         extname = path.splitext(self.source)[1]
         if extname.lower() in ['.dsf']:
@@ -619,10 +913,11 @@ class AudioTrack(object):
         self.UpdateMetadata()
         if checksum:
             self.UpdateFileChecksum()
-        self.id        = hashlib.sha224('{}{}'.format(self.GenPath(), extname).encode('utf-8')).hexdigest()
-        self.parent_id = hashlib.sha224(self.GenParentPath().encode('utf-8')).hexdigest()
+        self.id        = gen_id('{}{}'.format(self.gen_path, extname), id_algo)
+        self.parent_id = gen_id(self.gen_parent_path, id_algo)
 
-    def GenFilename(self):
+    @cached_property
+    def gen_filename(self):
         if not hasattr(self, 'metadata'):
             self.UpdateMetadata()
         try:
@@ -637,7 +932,8 @@ class AudioTrack(object):
                 genpath(self.metadata['title'])
             )
 
-    def GenParentPath(self):
+    @cached_property
+    def gen_parent_path(self):
         if not hasattr(self, 'metadata'):
             self.UpdateMetadata()
         return path.join(
@@ -645,33 +941,61 @@ class AudioTrack(object):
             genpath(self.metadata['album'])
         )
 
+    @cached_property
+    def gen_path(self):
+        return path.join(self.gen_parent_path, self.gen_filename)
+
+    def __getstate__(self):
+        ## cached paths are derived from metadata, so they are not pickled.
+        return {k:v for k, v in self.__dict__.items() if not k.startswith('gen_')}
+
+    def GenFilename(self):
+        return self.gen_filename
+
+    def GenParentPath(self):
+        return self.gen_parent_path
+
     def GenPath(self):
-        return path.join(self.GenParentPath(), self.GenFilename())
+        return self.gen_path
 
     def UpdateFileChecksum(self, program=DEFAULT_CHECKSUM_PROG):
+        """Calculate checksum of source file in-process.
+
+program is the name of a coreutils checksum program, e.g., sha224sum or md5sum,
+and the corresponding hashlib algorithm is used, or the program itself if
+hashlib does not provide it. Files are hashed by the Linux kernel crypto API
+where available, see _hash_file.
+"""
+        algo = program.replace('sum', '')
+        try:
+            csum = _hash_file(self.source, algo)
+        except ValueError:
+            ## program has no hashlib counterpart.
+            csum = run([program, '-b', self.source], check=True, stdout=PIPE).stdout.decode().split()[0]
         self.file_checksum = {
             'program': program,
-            'checksum': run([
-                program, '-b', self.source
-            ], check=True, stdout=PIPE, stderr=DEVNULL).stdout.decode().split()[0]
+            'checksum': csum
         }
 
-    def UpdateMetadata(self):
-        if self.format == 'DSD':
-            scheme = 'ID3'
-            metadata = DSF(self.source)
-        elif self.format == 'FLAC':
-            scheme = 'Vorbis'
-            metadata = FLAC(self.source)
-        else:
-            assert False, 'unsupported format {}.'.format(self.formmat)
-        self.metadata = load_tags(self.source)
+    def UpdateMetadata(self, metadata=None):
+        """Update metadata of this audio track.
+
+metadata is an already opened mutagen object of the source file, if available.
+"""
+        cls, scheme = resolve_format(self.source)
+        if metadata is None:
+            metadata = cls(self.source)
+        self.metadata = load_tags(self.source, audio=metadata, scheme=scheme)
+        ## generated paths depend on metadata.
+        for k in ['gen_filename', 'gen_parent_path', 'gen_path']:
+            self.__dict__.pop(k, None)
         if 'albumartist' not in self.metadata:
             try:
                 self.metadata['albumartist'] = self.metadata['artist']
             except KeyError:
                 self.metadata['artist'] = self.metadata['performer']
                 self.metadata['albumartist'] = self.metadata['performer']
+        intern_tags(self.metadata)
         self.metadata['info'] = {
             'sample_rate'     : metadata.info.sample_rate,
             'bits_per_sample' : metadata.info.bits_per_sample,
@@ -684,77 +1008,31 @@ class AudioTrack(object):
     def Export(self, filepath, preset, exists, bitrate):
         """Export this audio track with specified preset.
 """
-        if not hasattr(self, 'file_checksum'):
-            self.UpdateFileChecksum()
-        if path.isfile(filepath):
-            if exists.lower()[0] == 's':
-                ## skip
-                return filepath
-            elif exists.lower()[0] == 'u':
-                ## update
-                if self.file_checksum == get_source_file_checksum(filepath):
-                    return filepath
+        if self.IsExported(filepath, exists):
+            return filepath
         coverart_path = path.join(path.split(filepath)[0], 'cover.{}'.format(PRESETS[preset]['art_format']))
-        if preset.lower() in ['dxd', 'ldac', 'cd']:
-            if self.format == 'DSD':
-                ## dsf ------> aiff ------------> flac/opus
-                ##     ffmpeg       flac/opusenc
-                if self.metadata['info']['sample_rate'] > int(PRESETS[preset]['max_sample_rate']/48000+0.5)*44100*16:
-                    sample_rate=int(PRESETS[preset]['max_sample_rate']/48000+0.5)*44100
-                else:
-                    sample_rate=int(self.metadata['info']['sample_rate']/44100/16+0.5)*44100
-                ffmpeg = Popen([
-                    'ffmpeg', '-y', '-i', self.source,
-                    '-af', 'aresample=resampler=soxr:precision=28:dither_method=triangular:osr={:d},volume=+6dB'.format(sample_rate),
-                    '-vn', '-map_metadata', '-1',
-                    '-c:a', 'pcm_s24be',
-                    '-f', 'aiff', '-'
-                ], stdout=PIPE, stderr=DEVNULL)
-                flac_enc = Popen([
-                    'flac', '-', '-f',
-                    '--picture', '3|image/png|Cover||{}'.format(coverart_path),
-                    '--ignore-chunk-sizes', '--force-aiff-format',
-                    *gen_flac_tagopts(self.metadata),
-                    '-o', filepath
-                ], stdin=ffmpeg.stdout, stderr=DEVNULL)
-                flac_enc.communicate()
-            else:
-                q = int(self.metadata['info']['sample_rate']/44100+0.5)
-                b = self.metadata['info']['sample_rate'] // q
-                if q > PRESETS[preset]['max_sample_rate']//48000:
-                    sample_rate = PRESETS[preset]['max_sample_rate']//48000*b
-                    ## resample is required.
-                    flac_dec = Popen([
-                        'flac', self.source, '-d', '-c'
-                    ], stdout=PIPE, stderr=DEVNULL)
-                    ffmpeg = Popen([
-                        'ffmpeg', '-i', '-',
-                        '-af', 'aresample=resampler=soxr:precision=28:dither_method=triangular:osr={:d}'.format(sample_rate),
-                        '-vn', '-map_metadata', '-1',
-                        '-c:a', 'pcm_s24be',
-                        '-f', 'aiff', '-'
-                    ], stdin=flac_dec.stdout, stdout=PIPE, stderr=DEVNULL)
-                    flac_enc = Popen([
-                        'flac', '-', '-f', '--lax',
-                        '--picture', '3|image/png|Cover||{}'.format(path.join(path.split(filepath)[0], 'cover.png')),
-                        '--ignore-chunk-sizes', '--force-aiff-format',
-                        *gen_flac_tagopts(self.metadata),
-                        '-o', filepath
-                    ], stdin=ffmpeg.stdout, stdout=DEVNULL, stderr=DEVNULL)
-                    flac_enc.communicate()
-                else:
-                    shutil.copyfile(self.source, filepath)
-                    ## substitute cover art
-                    audio = FLAC(filepath)
-                    audio.clear_pictures()
-                    audio.save()
-                    add_cover_art(filepath, path.join(path.split(filepath)[0], 'cover.png'))
+        if self.IsBatchable(preset):
+            run([
+                'ffmpeg', '-y', '-i', self.source,
+                *self.GenFFmpegOutputArgs(0, filepath, preset, bitrate)
+            ], check=True, stdout=DEVNULL, stderr=DEVNULL)
+            self.TagFFmpegOutput(filepath, preset)
+        elif preset.lower() in ['dxd', 'ldac', 'cd']:
+            ## no resample is required.
+            shutil.copyfile(self.source, filepath)
+            ## substitute cover art
+            audio = FLAC(filepath)
+            audio.clear_pictures()
+            audio.save()
+            add_cover_art(filepath, path.join(path.split(filepath)[0], 'cover.png'))
         elif preset.lower() in ['itunes']:
-            with TemporaryDirectory(prefix=self.id, dir=path.split(filepath)[0]) as tmpdir:
+            ## afconvert only reads seekable files, so intermediate files
+            ## are written to SLIM_TMPDIR.
+            with TemporaryDirectory(prefix=self.id, dir=SLIM_TMPDIR) as tmpdir:
                 if self.format == 'DSD':
                     src = path.join(tmpdir, 'a.aiff')
                     run([
-                        'ffmpeg', '-y', '-i', self.source,
+                        'ffmpeg', '-y', '-i', self.source, '-threads', '{:d}'.format(FFMPEG_THREADS),
                         '-af', 'aresample=resampler=soxr:precision=32:dither_method=triangular:osr=352800,volume=+6dB',
                         '-c:a', 'pcm_s24be',
                         '-f', 'aiff', src
@@ -786,30 +1064,43 @@ class AudioTrack(object):
                 ], check=True)
                 if not wait_file(filepath):
                     raise FileNotFoundError(u'{} (m4a) not found.'.format(filepath))
-            copy_tags(self.source, filepath)
+            save_tags(self.metadata, filepath)
             add_cover_art(filepath, path.join(
                 path.split(filepath)[0],
                 'cover.{}'.format(PRESETS[preset]['art_format'])
             ))
-        elif preset.lower() in ['aac']:
+        elif preset.lower() in ['radio']:
+            ## ffmpeg decodes and resamples while lame encodes concurrently.
+            ## PCM is passed raw in little-endian byte order, without container.
+            ## lame reads raw input as stereo, or as mono if told so, hence
+            ## multichannel sources are downmixed to stereo.
             if bitrate is None:
                 bitrate = str(PRESETS[preset]['bitrate'])
-            qu = self.metadata['info']['sample_rate']//44100
-            br = self.metadata['info']['sample_rate']//qu
-            sr = br * min((PRESETS[preset]['max_sample_rate']//44100), qu)
             if self.format == 'DSD':
                 gain = ',volume=+6dB'
             else:
                 gain = ''
-            run([
-                'ffmpeg', '-y', '-i', self.source,
-                '-af', 'aresample=resampler=soxr:precision=24:dither_method=triangular:osr={:d}{}'.format(sr, gain),
-                '-vn', '-c:a', 'libfdk_aac', '-vbr', bitrate, filepath
-            ], check=True, stdout=DEVNULL, stderr=DEVNULL)
-            add_cover_art(filepath, path.join(
-                path.split(filepath)[0],
-                'cover.{}'.format(PRESETS[preset]['art_format'])
-            ))
+            b = self.metadata['info']['sample_rate'] // (self.metadata['info']['sample_rate']//44100)
+            mode   = []
+            layout = []
+            if self.metadata['info']['channels'] == 1:
+                mode   = ['-m', 'm']
+            elif self.metadata['info']['channels'] > 2:
+                layout = ['-ac', '2']
+            run_pipeline([
+                'ffmpeg', '-y', '-i', self.source, '-threads', '{:d}'.format(FFMPEG_THREADS),
+                '-af', 'aresample=resampler=soxr:precision={:d}:dither_method=triangular:osr={:d}{}'.format(
+                    PRESETS[preset]['soxr_precision'], b, gain),
+                '-vn', '-map_metadata', '-1', *layout,
+                '-c:a', 'pcm_s24le',
+                '-f', 's24le', '-'
+            ], [
+                'lame', '--silent', '-r', '-s', '{:g}'.format(b/1000.0),
+                '--bitwidth', '24', '--signed', '--little-endian', *mode,
+                '-b', bitrate, '-', filepath
+            ])
+            save_tags(self.metadata, filepath)
+            add_cover_art(filepath, coverart_path)
         elif preset.lower() in ['opus']:
             b = 48000 ## according to official opus codec RFC 6716 MDCT (modified discrete cosine transform)
                       ## layer of opus encoder always operates on 48kHz sampling rate.
@@ -819,14 +1110,13 @@ class AudioTrack(object):
                 gain = ',volume=+6dB'
             else:
                 gain = ''
-            ffmpeg = Popen([
-                'ffmpeg', '-y', '-i', self.source,
+            run_pipeline([
+                'ffmpeg', '-y', '-i', self.source, '-threads', '{:d}'.format(FFMPEG_THREADS),
                 '-af', 'aresample=resampler=soxr:precision=28:dither_method=triangular:osr={:d}{}'.format(b, gain),
-                '-vn', '-map_metadata', '-1',
+                '-vn', '-map_metadata', '-1', '-ac', '2',
                 '-c:a', 'pcm_s24le',
-                '-f', 'wav', '-'
-            ], stdout=PIPE, stderr=DEVNULL)
-            opus_enc = Popen([
+                '-f', 's24le', '-'
+            ], [
                 'opusenc', '-',
                 '--picture', '3||Cover||{}'.format(coverart_path),
                 '--raw', '--raw-bits', '24', '--raw-rate', '{:d}'.format(b), '--raw-chan', '2',
@@ -834,37 +1124,152 @@ class AudioTrack(object):
                 '--bitrate', '{}k'.format(bitrate),
                 *gen_opus_tagopts(self.metadata),
                 filepath
-            ], stdin=ffmpeg.stdout, stderr=DEVNULL)
-            opus_enc.communicate()
-        elif preset.lower() in ['radio']:
-            if bitrate is None:
-                bitrate = str(PRESETS[preset]['bitrate'])
-            q = self.metadata['info']['sample_rate']//44100
-            b = self.metadata['info']['sample_rate']//q
-            if self.format == 'DSD':
-                gain = ',volume=+6dB'
-            else:
-                gain = ''
-            run([
-                'ffmpeg', '-y', '-i', self.source,
-                '-af', 'aresample=resampler=soxr:precision=24:dither_method=triangular:osr={:d}{}'.format(b, gain),
-                '-vn', '-c:a', 'libmp3lame', '-b:a', '{}k'.format(bitrate), filepath
-            ], check=True, stdout=DEVNULL, stderr=DEVNULL)
-            add_cover_art(filepath, path.join(
-                path.split(filepath)[0],
-                'cover.{}'.format(PRESETS[preset]['art_format'])
-            ))
+            ])
         else:
             raise TypeError(u'unsupported preset {}.'.format(preset))
+        return self.Finalize(filepath)
+
+    def IsExported(self, filepath, exists, verify=True):
+        """Check if exporting this audio track to filepath can be skipped.
+
+Without verify, only stat and stamp checks are made, i.e., neither the
+source file nor the exported file is hashed.
+"""
+        if path.isfile(filepath):
+            if exists.lower()[0] == 's':
+                ## skip
+                return True
+            elif exists.lower()[0] == 'u':
+                ## update
+                if not hasattr(self, 'file_checksum'):
+                    if not verify:
+                        ## hashing is left to export workers.
+                        return False
+                    self.UpdateFileChecksum()
+                if self.ReadStamp(filepath) == self.GenStamp(filepath):
+                    return True
+                if verify and self.file_checksum == _cached_dest_checksum(filepath, *file_fingerprint(filepath)):
+                    self.WriteStamp(filepath)
+                    return True
+        return False
+
+    def IsBatchable(self, preset):
+        """Check if this audio track is exported with preset by ffmpeg alone,
+so that it can share an ffmpeg process with other tracks.
+"""
+        if preset.lower() in FFMPEG_PRESETS:
+            return True
+        return preset.lower() in ['dxd', 'ldac', 'cd'] and self.GenLosslessSampleRate(preset) is not None
+
+    def GenLosslessSampleRate(self, preset):
+        """Sample rate of this audio track exported with lossless preset, or None
+if the FLAC source is copied as is.
+"""
+        if self.format == 'DSD':
+            if self.metadata['info']['sample_rate'] > int(PRESETS[preset]['max_sample_rate']/48000+0.5)*44100*16:
+                return int(PRESETS[preset]['max_sample_rate']/48000+0.5)*44100
+            return int(self.metadata['info']['sample_rate']/44100/16+0.5)*44100
+        q = int(self.metadata['info']['sample_rate']/44100+0.5)
+        b = self.metadata['info']['sample_rate'] // q
+        if q > PRESETS[preset]['max_sample_rate']//48000:
+            return PRESETS[preset]['max_sample_rate']//48000*b
+        return None
+
+    def GenFFmpegOutputArgs(self, i, filepath, preset, bitrate):
+        """Generate ffmpeg output options to export input #i of ffmpeg to filepath.
+
+Only tracks that are batchable with preset are encoded by ffmpeg alone.
+"""
+        if not self.IsBatchable(preset):
+            raise TypeError(u'preset {} is not encoded by ffmpeg alone.'.format(preset))
+        if self.format == 'DSD':
+            gain = ',volume=+6dB'
+        else:
+            gain = ''
+        if preset.lower() in ['dxd', 'ldac', 'cd']:
+            ## dsf/flac ------> flac
+            ##          ffmpeg
+            return [
+                '-map', '{:d}:a'.format(i), '-map_metadata', '-1', '-threads', '{:d}'.format(FFMPEG_THREADS),
+                '-af', 'aresample=resampler=soxr:precision=28:dither_method=triangular:osr={:d}{}'.format(
+                    self.GenLosslessSampleRate(preset), gain),
+                '-c:a', 'flac', '-sample_fmt', 's32', '-bits_per_raw_sample', '24',
+                '-compression_level', '5',
+                '-f', 'flac', filepath
+            ]
+        if bitrate is None:
+            bitrate = str(PRESETS[preset]['bitrate'])
+        q = self.metadata['info']['sample_rate']//44100
+        b = self.metadata['info']['sample_rate']//q
+        sample_rate = b * min((PRESETS[preset]['max_sample_rate']//44100), q)
+        codec = ['-c:a', 'libfdk_aac', '-vbr', bitrate]
+        return [
+            '-map', '{:d}:a'.format(i), '-map_metadata', '{:d}'.format(i), '-threads', '{:d}'.format(FFMPEG_THREADS),
+            '-af', 'aresample=resampler=soxr:precision={:d}:dither_method=triangular:osr={:d}{}'.format(
+                PRESETS[preset]['soxr_precision'], sample_rate, gain),
+            *codec, filepath
+        ]
+
+    def TagFFmpegOutput(self, filepath, preset):
+        """Add tags and cover art to file encoded by ffmpeg alone.
+"""
+        coverart_path = path.join(path.split(filepath)[0], 'cover.{}'.format(PRESETS[preset]['art_format']))
+        if preset.lower() in ['dxd', 'ldac', 'cd']:
+            set_flac_tags(filepath, self.metadata, coverart_path)
+        else:
+            add_cover_art(filepath, coverart_path)
+
+    def Finalize(self, filepath):
+        """Record source file checksum to exported file.
+"""
         if not wait_file(filepath):
             raise FileNotFoundError(u'{} not found.'.format(filepath))
+        ## tracks of scanned libraries are hashed on first export.
+        if not hasattr(self, 'file_checksum'):
+            self.UpdateFileChecksum()
         set_source_file_checksum(
             filepath,
             self.file_checksum['checksum'],
             program=self.file_checksum['program']
         )
+        self.WriteStamp(filepath)
         return filepath
 
+    def GenStamp(self, filepath):
+        """Generate export stamp of this track and its exported file.
+
+The stamp records size and ctime of source file, source file checksum and
+size and mtime of exported file.
+"""
+        if not hasattr(self, 'file_checksum'):
+            self.UpdateFileChecksum()
+        st = os.stat(filepath)
+        return '{} {} {} {} {}\n'.format(
+            self.file['size'],
+            self.file['ctime'],
+            self.file_checksum['checksum'],
+            st.st_size,
+            st.st_mtime_ns
+        )
+
+    def ReadStamp(self, filepath):
+        """Read export stamp sidecar of exported file.
+"""
+        try:
+            fd = os.open(stamp_path(filepath), os.O_RDONLY)
+        except FileNotFoundError:
+            return None
+        try:
+            return os.read(fd, 4096).decode()
+        finally:
+            os.close(fd)
+
+    def WriteStamp(self, filepath):
+        """Write export stamp sidecar of exported file.
+"""
+        with open(stamp_path(filepath), 'w') as f:
+            f.write(self.GenStamp(filepath))
+
     def ExtractCoverArt(self, filepath):
         try:
             run(['ffmpeg', '-y', '-i', self.source,
@@ -899,14 +1304,29 @@ class AudioTrack(object):
         return
 
 class Album(list):
-    def __init__(self, title=None, artist=None):
+    def __init__(self, title=None, artist=None, id_algo=SLIM_ID_ALGO):
         self.title  = title
         self.artist = artist
-        self.id     = hashlib.sha224(self.GenPath().encode('utf-8')).hexdigest()
+        self.id     = gen_id(self.gen_path, id_algo)
 
-    def GenPath(self):
+    @cached_property
+    def gen_path(self):
         return path.join(genpath(self.artist), genpath(self.title))
 
+    def GenPath(self):
+        return self.gen_path
+
+    def __getstate__(self):
+        return {k:v for k, v in self.__dict__.items() if not k.startswith('gen_')}
+
+    def Head(self):
+        """Return a copy of this album with its first track only.
+"""
+        a = Album.__new__(Album)
+        a.__dict__.update(self.__getstate__())
+        a.append(self[0])
+        return a
+
     def ExtractCoverArt(self, prefix):
         self.cover_art_path = path.join(prefix, '{}.png'.format(self.id))
         if not wait_file(self[0].ExtractCoverArt(self.cover_art_path)):
@@ -914,6 +1334,20 @@ class Album(list):
         return self.GetCoverArtInfo()
 
     def GetCoverArtInfo(self):
+        if Image is not None:
+            with Image.open(self.cover_art_path) as img:
+                width, height = img.size
+                info = {
+                    'format'     : img.format,
+                    'geometry'   : '{:d}x{:d}'.format(width, height),
+                    'depth'      : 16 if img.mode.startswith('I;16') or img.mode == 'I' else 8,
+                    'colorspace' : img.mode,
+                    'filesize'   : path.getsize(self.cover_art_path),
+                    'width'      : width,
+                    'height'     : height
+                }
+            self.cover_art_info = info
+            return info
         result = run([
             'identify', self.cover_art_path
         ], check=True, stdout=PIPE).stdout.decode()
@@ -932,26 +1366,72 @@ class Album(list):
         self.cover_art_info = info
         return info
 
-def __import_worker__(q_in, q_out, checksum=True):
-    pack_in = q_in.get()
-    while pack_in is not None:
-        q_out.put(AudioTrack(pack_in, checksum))
-        pack_in = q_in.get()
-
-def __export_worker__(q_in, q_out):
-    pack_in = q_in.get()
-    while pack_in is not None:
-        tobj, outfile, preset, exists, bitrate = pack_in
-        q_out.put(tobj.Export(outfile, preset, exists, bitrate))
-        pack_in = q_in.get()
-
-def __extract_worker__(q_in, q_out):
-    pack_in = q_in.get()
-    while pack_in is not None:
-        aobj, prefix = pack_in
-        aobj.ExtractCoverArt(prefix)
-        q_out.put(aobj)
-        pack_in = q_in.get()
+def _build_one(pack_in):
+    filepath, checksum, id_algo = pack_in
+    return AudioTrack(filepath, checksum, id_algo)
+
+def _pin_worker(counter, nthreads=1, pin=True):
+    """Initialize pool worker: limit threads of ffmpeg and math libraries to
+nthreads and, if pin is True, pin the worker (and its children) to its own
+nthreads CPUs.
+
+Workers that run multi-process pipelines are not pinned, so that stages of
+a pipeline run on different CPUs.
+"""
+    global FFMPEG_THREADS
+    FFMPEG_THREADS = nthreads
+    os.environ['OMP_NUM_THREADS'] = '{:d}'.format(nthreads)
+    os.environ['OPENBLAS_NUM_THREADS'] = '{:d}'.format(nthreads)
+    with counter.get_lock():
+        i = counter.value
+        counter.value += 1
+    if not pin:
+        return
+    try:
+        cpus = sorted(os.sched_getaffinity(0))
+        j = nthreads*i
+        os.sched_setaffinity(0, [cpus[(j+k) % len(cpus)] for k in range(nthreads)])
+    except (AttributeError, OSError):
+        ## sched_setaffinity is not available on this platform, or not
+        ## permitted by cpuset of the container.
+        pass
+
+def _pending(tracks, to_paths, exists):
+    """Filter out tracks of which exported files can be skipped.
+"""
+    jobs = [(t, f) for t, f in zip(tracks, to_paths) if not t.IsExported(f, exists, verify=False)]
+    return [t for t, _ in jobs], [f for _, f in jobs]
+
+def _export_cost(tobj):
+    """Estimated cost of exporting audio track, i.e., number of source samples.
+"""
+    return tobj.metadata['info']['length'] * tobj.metadata['info']['sample_rate']
+
+def _export_one(pack_in):
+    tobj, outfile, preset, exists, bitrate = pack_in
+    return tobj.Export(outfile, preset, exists, bitrate)
+
+def _export_batch(pack_in):
+    """Export a batch of audio tracks with a single ffmpeg process.
+"""
+    tracks, to_paths, preset, exists, bitrate = pack_in
+    jobs = [(t, f) for t, f in zip(tracks, to_paths) if not t.IsExported(f, exists)]
+    if len(jobs) > 0:
+        args = ['ffmpeg', '-y']
+        for t, _ in jobs:
+            args += ['-i', t.source]
+        for i, (t, f) in enumerate(jobs):
+            args += t.GenFFmpegOutputArgs(i, f, preset, bitrate)
+        run(args, check=True, stdout=DEVNULL, stderr=DEVNULL)
+        for t, f in jobs:
+            t.TagFFmpegOutput(f, preset)
+            t.Finalize(f)
+    return to_paths
+
+def _extract(pack_in):
+    aobj, prefix = pack_in
+    aobj.ExtractCoverArt(prefix)
+    return aobj.id, aobj.cover_art_path, aobj.cover_art_info
 
 class Library(object):
     """SONY Music Library.
@@ -970,6 +1450,7 @@ class Library(object):
         self.albums = {}
         self.arts_path = path.join(outdir, 'arts')
         self.checksum_path = path.join(outdir, '{}.txt'.format(DEFAULT_CHECKSUM_PROG))
+        self.id_algo = SLIM_ID_ALGO
         self.ImportTracks(tracks, checksum=False)
         self.UpdateAlbums()
         ## self.ExtractCoverArts()
@@ -978,62 +1459,87 @@ class Library(object):
 
     def Build(self, libroot, outdir):
         """Build SONY Music Library from source directory.
+
+With MPI, tracks are distributed round-robin over all processes and the
+library is assembled on rank 0.
 """
+        mpi_rank = comm.Get_rank()
+        mpi_size = comm.Get_size()
         self.source = path.normpath(path.abspath(libroot))
-        if path.exists(outdir):
-            assert False, 'output directory already exists.'
-        os.makedirs(outdir)
+        ## rank 0 broadcasts None on error so that all processes fail
+        ## together instead of waiting for it.
+        tracks = None
+        if mpi_rank == 0 and not path.exists(outdir):
+            os.makedirs(outdir)
+            tracks = find_tracks(self.source)
+        tracks = comm.bcast(tracks, root=0)
+        assert tracks is not None, 'output directory already exists.'
         ##
         ## initialize containers.
-        tracks = find_tracks(self.source)
         self.tracks = {}
         self.albums = {}
         self.arts_path = path.join(outdir, 'arts')
         self.checksum_path = path.join(outdir, '{}.txt'.format(DEFAULT_CHECKSUM_PROG))
-        self.ImportTracks(tracks)
+        self.id_algo = SLIM_ID_ALGO
+        ## processes on the same node share its CPUs.
+        node_comm = comm.Split_type(MPI.COMM_TYPE_SHARED)
+        ncpus = max(1, cpu_count()//node_comm.Get_size())
+        node_comm.Free()
+        ## only rank 0 reports progress, of its own share of tracks.
+        self.ImportTracks(tracks[mpi_rank::mpi_size], ncpus=ncpus, quiet=mpi_rank!=0)
+        if mpi_size > 1:
+            parts = comm.gather(self.tracks, root=0)
+            if mpi_rank != 0:
+                return
+            self.tracks = {}
+            for part in parts:
+                for tid, tobj in part.items():
+                    if tid in self.tracks:
+                        print('Duplicate track found: {}'.format(tobj.source))
+                    else:
+                        self.tracks[tid] = tobj
         self.UpdateAlbums()
         self.ExtractCoverArts()
         print(u'{:d} audio tracks of {:d} album(s) loaded.'.format(len(self.tracks), len(self.albums)))
         return
 
-    def ImportTracks(self, tracks, checksum=True):
-        """Import SONY Music tracks.
+    def ImportTracks(self, tracks, checksum=True, ncpus=None, quiet=False):
+        """Import SONY Music tracks with ncpus worker processes and hashing
+threads (default: cpu_count()).
+
+Progress is not printed if quiet.
 """
+        if ncpus is None:
+            ncpus = cpu_count()
         tic = time()
-        new_tracks = []
-        q_file   = Queue()
-        q_obj    = Queue()
-        workers  = []
-        nworkers = max(2, cpu_count())
         ntrks = len(tracks)
-        for i in range(nworkers):
-            proc = Process(target=__import_worker__, args=(q_file, q_obj, checksum))
-            proc.start()
-            workers.append(proc)
-        sys.stdout.write(u'Importing audio tracks......')
-        sys.stdout.flush()
-        for t in tracks:
-            q_file.put(t)
-        i = 0
-        while i < ntrks:
-            tobj = q_obj.get()
-            if tobj.id in self.tracks:
-                print('Duplicate track found: {}'.format(tobj.source))
-            else:
-                self.tracks[tobj.id] = tobj
-            i += 1
-            sys.stdout.write(u'\rImporting audio tracks......{:d}/{:d} ({:5.1f}%)'.format(i, ntrks, 100.0*i/ntrks))
+        if not quiet:
+            sys.stdout.write(u'Importing audio tracks......')
+            sys.stdout.flush()
+        ## checksums are calculated by threads of this process while the
+        ## worker processes parse metadata.
+        with ThreadPoolExecutor(max_workers=ncpus) as tp, Pool(max(2, ncpus)) as pool:
+            if checksum:
+                algo  = DEFAULT_CHECKSUM_PROG.replace('sum', '')
+                csums = {t:tp.submit(_hash_file, t, algo) for t in tracks}
+            i = 0
+            for tobj in pool.imap_unordered(_build_one, [(t, False, self.id_algo) for t in tracks], chunksize=8):
+                if checksum:
+                    tobj.file_checksum = {
+                        'program': DEFAULT_CHECKSUM_PROG,
+                        'checksum': csums[tobj.source].result()
+                    }
+                if tobj.id in self.tracks:
+                    print('Duplicate track found: {}'.format(tobj.source))
+                else:
+                    self.tracks[tobj.id] = tobj
+                i += 1
+                if not quiet:
+                    _progress(u'Importing audio tracks', i, ntrks)
+        if not quiet:
+            run(['stty', 'sane'], stdout=DEVNULL, stderr=DEVNULL)
+            sys.stdout.write(u'\rImporting audio tracks......Finished. ({:.2f} seconds)\n'.format(time()-tic))
             sys.stdout.flush()
-        for i in range(nworkers):
-            q_file.put(None)
-        for proc in workers:
-            proc.join()
-        run(['stty', 'sane'], stdout=DEVNULL, stderr=DEVNULL)
-        sys.stdout.write(u'\rImporting audio tracks......Finished. ({:.2f} seconds)\n'.format(time()-tic))
-        sys.stdout.flush()
-        for t in new_tracks:
-            if t.id not in self.tracks:
-                self.tracks[t.id] = t
 
     def UpdateAlbums(self):
         self.albums = {}
@@ -1042,43 +1548,113 @@ class Library(object):
         sys.stdout.flush()
         for t in self.tracks.values():
             if t.parent_id not in self.albums:
-                self.albums[t.parent_id] = Album(title=t.metadata['album'], artist=t.metadata['albumartist'])
+                self.albums[t.parent_id] = Album(
+                    title=t.metadata['album'], artist=t.metadata['albumartist'], id_algo=self.id_algo)
             self.albums[t.parent_id].append(t)
+        self.UpdateIndex()
         sys.stdout.write(u'\rUpdating albums......Finished. ({:.2f} seconds)\n'.format(time()-tic))
+
+    def UpdateIndex(self):
+        """Index albums by artist and title.
+"""
+        self.index = {}
+        for a in self.albums.values():
+            self.index.setdefault(a.artist, {})[a.title] = a
+
+    def ToDict(self):
+        """Convert library to plain containers for serialization.
+"""
+        d = {k:v for k, v in self.__dict__.items() if k not in ['tracks', 'albums', 'index']}
+        ## tracks are stored by columns of attributes and tags, so keys are
+        ## stored once instead of once per track. None marks a missing field.
+        ntrks = len(self.tracks)
+        attrs = {}
+        tags  = {}
+        for j, t in enumerate(self.tracks.values()):
+            st = t.__getstate__()
+            for k, v in st.pop('metadata', {}).items():
+                tags.setdefault(k, [None]*ntrks)[j] = v
+            for k, v in st.items():
+                attrs.setdefault(k, [None]*ntrks)[j] = v
+        d['track_columns'] = {'attrs': attrs, 'metadata': tags, 'length': ntrks}
+        d['albums'] = {aid:dict(
+            a.__getstate__(), tracks=[t.id for t in a]
+        ) for aid, a in self.albums.items()}
+        return d
+
+    @classmethod
+    def FromDict(cls, d):
+        """Restore library from plain containers.
+"""
+        l = cls.__new__(cls)
+        if 'track_columns' in d:
+            cols  = d.pop('track_columns')
+            attrs = cols['attrs'].items()
+            tags  = cols['metadata'].items()
+            tracks = []
+            for j in range(cols['length']):
+                td = {k:c[j] for k, c in attrs if c[j] is not None}
+                td['metadata'] = intern_tags({k:c[j] for k, c in tags if c[j] is not None})
+                tracks.append(td)
+            tracks = {td['id']:td for td in tracks}
+        else:
+            tracks = d.pop('tracks')
+        albums = d.pop('albums')
+        l.__dict__.update(d)
+        l.tracks = {}
+        for tid, td in tracks.items():
+            t = AudioTrack.__new__(AudioTrack)
+            t.__dict__.update(td)
+            l.tracks[tid] = t
+        l.albums = {}
+        for aid, ad in albums.items():
+            a = Album.__new__(Album)
+            a.extend(l.tracks[tid] for tid in ad.pop('tracks'))
+            a.__dict__.update(ad)
+            l.albums[aid] = a
+        l.UpdateIndex()
+        return l
+
+    def MatchAlbums(self, artist_match='', album_match=''):
+        """Generate albums of which artist and title contain specified strings.
+"""
+        if not hasattr(self, 'index'):
+            self.UpdateIndex()
+        for artist, albums in self.index.items():
+            if artist_match in artist:
+                for title, a in albums.items():
+                    if album_match in title:
+                        yield a
+
+    def MatchTracks(self, artist_match='', album_match='', track_match=''):
+        """Generate tracks matched by artist, album and track filename.
+"""
+        for a in self.MatchAlbums(artist_match, album_match):
+            for t in a:
+                if track_match in t.gen_filename:
+                    yield t
     
     def ExtractCoverArts(self):
         """Extract album cover arts.
 """
         if not path.exists(self.arts_path):
             os.makedirs(self.arts_path)
-        q_alb = Queue()
-        q_pic = Queue()
-        workers = []
-        nworkers = cpu_count()
         nalbs = len(self.albums)
-        for i in range(nworkers):
-            proc = Process(target=__extract_worker__, args=(q_alb, q_pic))
-            proc.start()
-            workers.append(proc)
-        for a in self.albums.values():
-            q_alb.put((a, self.arts_path))
         tic = time()
         sys.stdout.write('Extracting album cover arts......')
         sys.stdout.flush()
-        i = 0
-        while i < nalbs:
-            a = q_pic.get()
-            self.albums[a.id] = a
-            i += 1
-            sys.stdout.write(u'\rExtracting album cover arts......{:d}/{:d} ({:5.1f}%)'.format(i, nalbs, 100.0*i/nalbs))
-            sys.stdout.flush()
+        with ProcessPoolExecutor(max_workers=cpu_count()) as executor:
+            i = 0
+            for aid, cover_art_path, cover_art_info in executor.map(
+                    _extract, [(a.Head(), self.arts_path) for a in self.albums.values()],
+                    chunksize=max(1, nalbs//(cpu_count()*4))):
+                self.albums[aid].cover_art_path = cover_art_path
+                self.albums[aid].cover_art_info = cover_art_info
+                i += 1
+                _progress(u'Extracting album cover arts', i, nalbs)
         sys.stdout.write(u'\rExtracting album cover arts......Finished. ({:.2f} seconds)\n'.format(time()-tic))
         sys.stdout.flush()
         run(['stty', 'sane'], stdout=DEVNULL, stderr=DEVNULL)
-        for i in range(nworkers):
-            q_alb.put(None)
-        for proc in workers:
-            proc.join()
 
     def SortCoverArts(self, sortkey, reverse=False):
         """Sort album cover arts.
@@ -1108,16 +1684,52 @@ class Library(object):
         new_tracks = []
         src_tracks = {t.source:t.file for t in self.tracks.values()}
         for t in find_tracks(self.source):
-            if t in src_tracks:
-                if path.getctime(t) > src_tracks[t]['ctime'] or path.getsize(t) != src_tracks[t]['size']:
-                    new_tracks.append(t)
-            else:
+            rec = src_tracks.get(t)
+            if rec is None:
                 new_tracks.append(t)
+            else:
+                ## unchanged tracks keep their checksums, only modified ones
+                ## are hashed again.
+                st = os.stat(t)
+                if st.st_ctime > rec['ctime'] or st.st_size != rec['size'] or \
+                   st.st_mtime_ns != rec.get('mtime', st.st_mtime_ns):
+                    new_tracks.append(t)
         self.ImportTracks(new_tracks)
         self.UpdateAlbums()
         self.ExtractCoverArts()
         print(u'{:d} audio tracks of {:d} album(s) loaded.'.format(len(self.tracks), len(self.albums)))
 
+    def PrepareAlbums(self, artist_match, album_match, prefix, preset):
+        """Prepare directories and cover arts of matched albums for export.
+"""
+        fmt = PRESETS[preset]['art_format']
+        res = PRESETS[preset]['art_resolution']
+        jobs = []
+        for a in self.MatchAlbums(artist_match, album_match):
+            target_dir = path.join(prefix, a.gen_path)
+            if not path.exists(target_dir):
+                os.makedirs(target_dir)
+            src = path.join(self.arts_path, '{}.png'.format(a.id))
+            dst = path.join(target_dir, 'cover.{}'.format(fmt))
+            ## cover arts converted by previous exports are kept.
+            try:
+                if os.stat(dst).st_mtime_ns >= os.stat(src).st_mtime_ns:
+                    continue
+            except FileNotFoundError:
+                pass
+            jobs.append((src, dst))
+        nalbs = len(jobs)
+        tic = time()
+        sys.stdout.write(u'Preparing album directories......')
+        sys.stdout.flush()
+        with ThreadPoolExecutor(max_workers=cpu_count()) as executor:
+            futures = [executor.submit(resize_cover_art, src, dst, fmt, res) for src, dst in jobs]
+            for i, future in enumerate(as_completed(futures)):
+                future.result()
+                _progress(u'Preparing album directories', i+1, nalbs)
+        sys.stdout.write(u'\rPreparing album directories......Finished. ({:.2f} seconds)\n'.format(time()-tic))
+        sys.stdout.flush()
+
     def Export(self, match=None, prefix=None, preset='dxd', exists='skip', verbose=False, bitrate=None):
         """Export matched tracks.
 """
@@ -1132,67 +1744,55 @@ class Library(object):
         if mpi_size == 1:
             ## non-mpi parallelism, but multiprocessing
             ## prepare albums
-            nalbs = len(self.albums)
-            i = 0
-            tic = time()
-            sys.stdout.write(u'Preparing album directories......')
-            sys.stdout.flush()
-            for a in self.albums.values():
-                i+=1
-                if artist_match in a.artist and album_match in a.title:
-                    if not path.exists(path.join(prefix, a.GenPath())):
-                        os.makedirs(path.join(prefix, a.GenPath()))
-                    if PRESETS[preset]['art_resolution'] is None:
-                        args = [
-                            'convert',
-                            path.join(self.arts_path, '{}.png'.format(a.id)),
-                            path.join(prefix, a.GenPath(), 'cover.{}'.format(PRESETS[preset]['art_format']))
-                        ]
-                    else:
-                        args = [
-                            'convert',
-                            path.join(self.arts_path, '{}.png'.format(a.id)),
-                            '-resize', '{:d}x{:d}>'.format(PRESETS[preset]['art_resolution'], PRESETS[preset]['art_resolution']),
-                            path.join(prefix, a.GenPath(), 'cover.{}'.format(PRESETS[preset]['art_format']))
-                        ]
-                    run(args, check=True, stdout=DEVNULL, stderr=DEVNULL)
-                sys.stdout.write(u'\rPreparing album directories......{:d}/{:d} ({:5.1f}%)'.format(i, nalbs, 100.0*i/nalbs))
-                sys.stdout.flush()
-            sys.stdout.write(u'\rPreparing album directories......Finished. ({:.2f} seconds)\n'.format(time()-tic))
-            sys.stdout.flush()
+            self.PrepareAlbums(artist_match, album_match, prefix, preset)
             ## export
+            ext      = PRESETS[preset]['extension']
             to_path  = []
             tracks   = []
-            for t in self.tracks.values():
-                if artist_match in t.metadata['albumartist'] and album_match in t.metadata['album'] and track_match in t.GenFilename():
-                    tracks.append(t)
-                    to_path.append(u'{}.{}'.format(path.join(prefix, t.GenPath()), PRESETS[preset]['extension']))
-            q_obj    = Queue()
-            q_out    = Queue()
+            for t in self.MatchTracks(artist_match, album_match, track_match):
+                tracks.append(t)
+                to_path.append(u'{}.{}'.format(path.join(prefix, t.gen_path), ext))
+            tracks, to_path = _pending(tracks, to_path, exists)
             ntrks    = len(tracks)
-            nworkers = max(2, cpu_count())
-            workers  = []
-            for i in range(nworkers):
-                proc = Process(target=__export_worker__, args=(q_obj, q_out))
-                proc.start()
-                workers.append(proc)
-            for i in range(ntrks):
-                q_obj.put((tracks[i], to_path[i], preset, exists, bitrate))
+            ## tracks encoded by ffmpeg alone are exported in batches of the
+            ## same album, format and sample rate, with one ffmpeg each.
+            groups = {}
+            jobs   = []
+            for j in range(ntrks):
+                if tracks[j].IsBatchable(preset):
+                    groups.setdefault((
+                        tracks[j].parent_id,
+                        tracks[j].format,
+                        tracks[j].metadata['info']['sample_rate']
+                    ), []).append(j)
+                else:
+                    jobs.append((_export_one, (tracks[j], to_path[j], preset, exists, bitrate)))
+            jobs += [(_export_batch, (
+                [tracks[j] for j in g[k:k+FFMPEG_BATCH_SIZE]],
+                [to_path[j] for j in g[k:k+FFMPEG_BATCH_SIZE]],
+                preset, exists, bitrate
+            )) for g in groups.values() for k in range(0, len(g), FFMPEG_BATCH_SIZE)]
+            ## longest jobs first, so that no long job is left at the tail.
+            jobs.sort(key=lambda job:sum(map(
+                _export_cost, job[1][0] if job[0] is _export_batch else [job[1][0]]
+            )), reverse=True)
+            ## single-threaded ffmpeg per CPU, unless there are fewer jobs than
+            ## CPUs, in which case spare CPUs go to ffmpeg threads.
+            nthreads = max(1, cpu_count()//max(1, len(jobs)))
+            nworkers = max(1, cpu_count()//nthreads)
             tic = time()
             i = 0
             sys.stdout.write(u'Exporting audio tracks......')
             sys.stdout.flush()
-            while i < ntrks:
-                outfile = q_out.get()
-                i += 1
-                sys.stdout.write(
-                    u'\rExporting audio tracks......{:d}/{:d} ({:5.1f}%)'.format(
-                        i, ntrks, 100.0*i/ntrks))
-                sys.stdout.flush()
-            for i in range(nworkers):
-                q_obj.put(None)
-            for proc in workers:
-                proc.join()
+            with ProcessPoolExecutor(max_workers=nworkers, initializer=_pin_worker, initargs=(Value('i', 0), nthreads, preset.lower() not in PIPELINE_PRESETS)) as executor:
+                futures = [executor.submit(func, pack_in) for func, pack_in in jobs]
+                for future in as_completed(futures):
+                    outfile = future.result()
+                    if isinstance(outfile, list):
+                        i += len(outfile)
+                    else:
+                        i += 1
+                    _progress(u'Exporting audio tracks', i, ntrks)
             sys.stdout.write(u'\r\rExporting audio tracks......Finished. ({:.2f} seconds)\n'.format(time() - tic))
             sys.stdout.flush()
             run(['stty', 'sane'], stdout=DEVNULL, stderr=DEVNULL)
@@ -1200,72 +1800,55 @@ class Library(object):
             ## mpi parallelism
             tic = time()
             if mpi_rank == 0:
-                nalbs = len(self.albums)
-                i = 0
-                tic = time()
-                sys.stdout.write(u'Preparing album directories......')
-                sys.stdout.flush()
-                for a in self.albums.values():
-                    i+=1
-                    if artist_match in a.artist and album_match in a.title:
-                        if not path.exists(path.join(prefix, a.GenPath())):
-                            os.makedirs(path.join(prefix, a.GenPath()))
-                        if PRESETS[preset]['art_resolution'] is None:
-                            args = [
-                                'convert',
-                                path.join(self.arts_path, '{}.png'.format(a.id)),
-                                path.join(prefix, a.GenPath(), 'cover.{}'.format(PRESETS[preset]['art_format']))
-                            ]
-                        else:
-                            args = [
-                                'convert',
-                                path.join(self.arts_path, '{}.png'.format(a.id)),
-                                '-resize', '{:d}x{:d}>'.format(PRESETS[preset]['art_resolution'], PRESETS[preset]['art_resolution']),
-                                path.join(prefix, a.GenPath(), 'cover.{}'.format(PRESETS[preset]['art_format']))
-                            ]
-                        run(args, check=True, stdout=DEVNULL, stderr=DEVNULL)
-                    sys.stdout.write(u'\rPreparing album directories......{:d}/{:d} ({:5.1f}%)'.format(i, nalbs, 100.0*i/nalbs))
-                    sys.stdout.flush()
-                sys.stdout.write(u'\rPreparing album directories......Finished. ({:.2f} seconds)\n'.format(time()-tic))
-                sys.stdout.flush()
-                sleep(1.0)
-                to_path  = []
-                tracks   = []
-                for t in self.tracks.values():
-                    if artist_match in t.metadata['albumartist'] and album_match in t.metadata['album'] and track_match in t.GenFilename():
-                        tracks.append(t)
-                        to_path.append(u'{}.{}'.format(path.join(prefix, t.GenPath()), PRESETS[preset]['extension']))
-            else:
-                tracks  = None
-                to_path = None
-            tracks  = comm.bcast( tracks, root=0)
-            to_path = comm.bcast(to_path, root=0)
-            ntrks   = len(tracks)
+                self.PrepareAlbums(artist_match, album_match, prefix, preset)
+            ## every process holds the same library, so matched tracks are
+            ## listed locally in the same order instead of being broadcast.
+            ext      = PRESETS[preset]['extension']
+            to_path  = []
+            tracks   = []
+            for t in self.MatchTracks(artist_match, album_match, track_match):
+                tracks.append(t)
+                to_path.append(u'{}.{}'.format(path.join(prefix, t.gen_path), ext))
+            comm.Barrier()
             node    = hostname()
             node    = comm.gather(node, root=0)
             if mpi_rank == 0:
                 for i in range(mpi_size):
-                    sleep(.1)
                     print(u'Process {}/{} is ready on [{}].'.format(i+1, mpi_size, node[i]))
                 print(u'All processes are ready.')
-                itrks = list(map(len, [tracks[i::(mpi_size-1)] for i in range(mpi_size-1)]))
-                t = np.zeros(mpi_size-1, dtype='int64')
-                while np.sum(t)<ntrks:
-                    sleep(.5)
-                    for i in range(mpi_size-1):
-                        sleep(.1)
-                        if t[i]<itrks[i]:
-                            msg = comm.recv(source=i+1, tag=11)
-                            t[i] += 1
-                        sys.stdout.write(u'\rExporting audio tracks......{:d}/{:d} ({:5.1f}%)'.format(int(np.sum(t)), ntrks, 100.0*np.sum(t)/ntrks))
-                        sys.stdout.flush()
+                ## only rank 0 checks existing outputs, workers receive
+                ## indices of pending tracks.
+                queue    = [j for j in range(len(tracks)) if not tracks[j].IsExported(to_path[j], exists, verify=False)]
+                queue.sort(key=lambda j:_export_cost(tracks[j]), reverse=True)
+                ntrks    = len(queue)
+                ## dynamic dispatch: each worker reports its last finished
+                ## track (-1 for none) and receives the next one, or -1 to stop.
+                status   = MPI.Status()
+                nsent    = 0
+                ndone    = 0
+                nstopped = 0
+                while nstopped < mpi_size-1:
+                    idx = comm.recv(source=MPI.ANY_SOURCE, tag=11, status=status)
+                    if idx >= 0:
+                        ndone += 1
+                        _progress(u'Exporting audio tracks', ndone, ntrks)
+                    if nsent < ntrks:
+                        comm.send(queue[nsent], dest=status.Get_source(), tag=12)
+                        nsent += 1
+                    else:
+                        comm.send(-1, dest=status.Get_source(), tag=12)
+                        nstopped += 1
                 sys.stdout.write(u'\rExporting audio tracks......Finished. ({:.2f} seconds)\n'.format(time() - tic))
                 sys.stdout.flush()
                 run(['stty', 'sane'], stdout=DEVNULL, stderr=DEVNULL)
             else:
-                for i in range(mpi_rank-1, ntrks, mpi_size-1):
-                    comm.send(tracks[i].Export(to_path[i], preset, exists, bitrate), dest=0, tag=11)
-                    sleep(.1)
+                idx = -1
+                while True:
+                    comm.send(idx, dest=0, tag=11)
+                    idx = comm.recv(source=0, tag=12)
+                    if idx < 0:
+                        break
+                    tracks[idx].Export(to_path[idx], preset, exists, bitrate)
 
     def Print(self, match=None, verbose=False, output=''):
         """Print matched albums and audio tracks.
@@ -1282,36 +1865,120 @@ class Library(object):
                 fields = ['albumartist', 'album', 'tracknumber', 'artist', 'title', 'genre', 'composer', 'conductor']
                 writer = csv.DictWriter(csvfile, fieldnames=fields, extrasaction='ignore')
                 writer.writeheader()
-                for t in self.tracks.values():
-                    if artist_match in t.metadata['albumartist'] and album_match in t.metadata['album'] and track_match in t.GenFilename():
-                        tt = {}
-                        for k in t.metadata:
-                            try:
-                                tt[k] = '<br \>'.join(t.metadata[k].splitlines())
-                            except AttributeError:
-                                tt[k] = t.metadata[k]
-                        writer.writerow(tt)
+                for t in self.MatchTracks(artist_match, album_match, track_match):
+                    tt = {}
+                    for k in t.metadata:
+                        try:
+                            tt[k] = '<br \>'.join(t.metadata[k].splitlines())
+                        except AttributeError:
+                            tt[k] = t.metadata[k]
+                    writer.writerow(tt)
         except IOError:
             ## print to stdout
-            for a in self.albums.values():
-                if artist_match in a.artist and album_match in a.title:
-                    print(u'{}/{}:'.format(a.artist, a.title))
-                    for t in a:
-                        if track_match in t.GenFilename():
-                            try:
-                                print(u'  [{:<4}] {:d}.{:02d} - {}'.format(t.format, t.metadata['discnumber'], t.metadata['tracknumber'], t.metadata['title']))
-                            except KeyError:
-                                print(u'  [{:<4}] {:02d} - {}'.format(t.format, t.metadata['tracknumber'], t.metadata['title']))
-                            if verbose:
-                                t.Print()
+            for a in self.MatchAlbums(artist_match, album_match):
+                print(u'{}/{}:'.format(a.artist, a.title))
+                for t in a:
+                    if track_match in t.gen_filename:
+                        try:
+                            print(u'  [{:<4}] {:d}.{:02d} - {}'.format(t.format, t.metadata['discnumber'], t.metadata['tracknumber'], t.metadata['title']))
+                        except KeyError:
+                            print(u'  [{:<4}] {:02d} - {}'.format(t.format, t.metadata['tracknumber'], t.metadata['title']))
+                        if verbose:
+                            t.Print()
 
 def save_library(obj, to_path):
-    with open(to_path, 'wb') as f:
-        pickle.dump(obj, f)
+    """Save library as zstd-compressed msgpack, or gzip-compressed pickle if
+msgspec or zstandard is not available.
+
+The database is written to a temporary file first and then renamed, so an
+interrupted save never leaves a truncated database.
+"""
+    tmp_path = '{}.tmp'.format(to_path)
+    with open(tmp_path, 'wb') as f:
+        if msgspec is None:
+            with gzip.GzipFile(fileobj=f, mode='wb', compresslevel=1) as gz:
+                pickle.dump(obj, gz, protocol=pickle.HIGHEST_PROTOCOL)
+        else:
+            f.write(LIBRARY_MAGIC)
+            f.write(zstandard.ZstdCompressor(level=3).compress(
+                msgspec.msgpack.encode(obj.ToDict())
+            ))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, to_path)
+
+def loads_library(data):
+    """Load library from bytes-like object data in the format of save_library.
+"""
+    if bytes(data[:len(LIBRARY_MAGIC)]) == LIBRARY_MAGIC:
+        if msgspec is None:
+            raise ImportError('msgspec and zstandard are required to load this library.')
+        l = Library.FromDict(msgspec.msgpack.decode(
+            zstandard.ZstdDecompressor().decompress(data[len(LIBRARY_MAGIC):])
+        ))
+    elif bytes(data[:2]) == b'\x1f\x8b':
+        l = pickle.loads(gzip.decompress(data))
+    else:
+        l = pickle.loads(data)
+    if not hasattr(l, 'id_algo'):
+        l.id_algo = 'sha224'
+    return l
 
 def load_library(from_path):
+    """Load library saved by save_library, pickled databases included.
+"""
     with open(from_path, 'rb') as f:
-        return pickle.load(f)
+        return loads_library(f.read())
+
+def _read_bytes(filepath):
+    with open(filepath, 'rb') as f:
+        return f.read()
+
+def load_library_shared(from_path, prefetch=None):
+    """Load library on all MPI processes.
+
+The database is read once per node into shared memory, from which each
+process of the node deserializes its own library.
+prefetch is an optional future of the database content on the process that
+reads it.
+"""
+    node_comm = comm.Split_type(MPI.COMM_TYPE_SHARED)
+    node_rank = node_comm.Get_rank()
+    if node_rank == 0:
+        buf = _read_bytes(from_path) if prefetch is None else prefetch.result()
+        size = len(buf)
+        shm = shared_memory.SharedMemory(create=True, size=max(1, size))
+        shm.buf[:size] = buf
+        del buf
+        name = shm.name
+    else:
+        name, size = None, None
+    name, size = node_comm.bcast((name, size), root=0)
+    if node_rank != 0:
+        ## the segment is owned and unlinked by node rank 0, so it must not be
+        ## tracked (and unlinked at exit) by the other processes.
+        if sys.version_info >= (3, 13):
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        else:
+            shm = shared_memory.SharedMemory(name=name)
+            ## older Pythons always register attached segments. The private
+            ## _name is the name as registered (with the leading slash on
+            ## POSIX). If it goes away the tracker only warns at exit.
+            try:
+                resource_tracker.unregister(shm._name, 'shared_memory')
+            except AttributeError:
+                pass
+    data = shm.buf[:size]
+    try:
+        l = loads_library(data)
+    finally:
+        data.release()
+        node_comm.Barrier()
+        shm.close()
+        if node_rank == 0:
+            shm.unlink()
+        node_comm.Free()
+    return l
 
 def main():
     mpi_rank = comm.Get_rank()
@@ -1353,10 +2020,10 @@ def main():
             l.Scan(srcdir, path.abspath(outdir))
             save_library(l, path.join(outdir, 'main.db'))
     elif action.lower() in ['build']:
+        outdir = path.normpath(path.abspath(args[0]))
+        l = Library()
+        l.Build(srcdir, path.abspath(outdir))
         if mpi_rank == 0:
-            outdir = path.normpath(path.abspath(args[0]))
-            l = Library()
-            l.Build(srcdir, path.abspath(outdir))
             save_library(l, path.join(outdir, 'main.db'))
     elif action.lower() in ['help']:
         if mpi_rank == 0:
@@ -1366,12 +2033,19 @@ def main():
             l = load_library(args[0])
             l.Print(match=matched, verbose=verbose, output=output)
     elif action.lower() in ['export']:
-        if mpi_rank == 0:
-            l = load_library(path.normpath(path.abspath(path.realpath(args[0]))))
-        else:
-            l = None
-        l = comm.bcast(l, root=0)
-        sleep(0.5)
+        ## the library database is expected on a filesystem shared by all
+        ## processes, so only its path is broadcast.
+        ## rank 0 starts reading before the broadcast so that its I/O
+        ## overlaps the collective.
+        with ThreadPoolExecutor(max_workers=1) as tp:
+            if mpi_rank == 0:
+                dbpath = path.normpath(path.abspath(path.realpath(args[0])))
+                fut = tp.submit(_read_bytes, dbpath)
+            else:
+                dbpath = None
+                fut = None
+            dbpath = comm.bcast(dbpath, root=0)
+            l = load_library_shared(dbpath, prefetch=fut)
         l.Export(
             match=matched,
             preset=preset,
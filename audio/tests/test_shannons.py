@@ -0,0 +1,22 @@
+#coding=utf-8
+"""Tests of shannons.py.
+"""
+import sys
+from os import path
+import pytest
+
+np = pytest.importorskip('numpy')
+sf = pytest.importorskip('soundfile')
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+import shannons
+
+@pytest.mark.parametrize('bits', [8, 28])
+def test_silent_channel(tmp_path, bits):
+    src = str(tmp_path / 'silent.wav')
+    data = np.zeros((4096, 2))
+    data[:,1] = np.resize([-0.5, 0.5], 4096)
+    sf.write(src, data, 44100, subtype='PCM_24')
+    info = shannons.analyze_soundfile(src, bits=bits, blocksize=1000)
+    assert np.all(np.isfinite(info['shannons']))
+    assert info['shannons'][0] == pytest.approx(0.0)
+    assert info['shannons'][1] == pytest.approx(1.0)
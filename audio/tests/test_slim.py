@@ -0,0 +1,71 @@
+#coding=utf-8
+"""Tests of slim.py.
+
+Sources are short silent FLAC files written by soundfile and tagged by mutagen.
+Tests that encode need the external programs of their preset.
+"""
+import sys
+import os
+import shutil
+from os import path
+import pytest
+
+np = pytest.importorskip('numpy')
+sf = pytest.importorskip('soundfile')
+pytest.importorskip('mpi4py')
+pytest.importorskip('mutagen')
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+import slim
+from mutagen.flac import FLAC
+
+TAGS = {
+    'title'       : 'Silence',
+    'album'       : 'Nothing',
+    'artist'      : 'Nobody',
+    'albumartist' : 'Nobody',
+    'tracknumber' : '1',
+    'date'        : '2001',
+    'comment'     : 'quiet'
+}
+
+def make_source(dirpath, channels=2, samplerate=44100):
+    src = path.join(dirpath, 'source.flac')
+    sf.write(src, np.zeros((samplerate, channels)), samplerate, subtype='PCM_24')
+    audio = FLAC(src)
+    for k, v in TAGS.items():
+        audio[k] = v
+    audio.save()
+    return src
+
+def make_outdir(dirpath, art_format):
+    outdir = path.join(dirpath, 'out')
+    os.makedirs(outdir)
+    ## cover arts are copied as is, their content is never decoded.
+    with open(path.join(outdir, 'cover.{}'.format(art_format)), 'wb') as f:
+        f.write(b'cover')
+    return outdir
+
+def test_export_unchecksummed_track(tmp_path):
+    src = make_source(str(tmp_path))
+    trk = slim.AudioTrack(src, checksum=False)
+    assert not hasattr(trk, 'file_checksum')
+    dst = path.join(make_outdir(str(tmp_path), 'png'), 'track.flac')
+    trk.Export(dst, 'cd', 'skip', None)
+    assert trk.file_checksum['checksum'] == slim._hash_file(src, 'sha224')
+    assert slim.get_source_file_checksum(dst)['checksum'] == trk.file_checksum['checksum']
+    assert trk.IsExported(dst, 'update')
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None or shutil.which('lame') is None,
+                    reason='ffmpeg and lame are required.')
+def test_radio_export_tags(tmp_path):
+    src = make_source(str(tmp_path))
+    trk = slim.AudioTrack(src)
+    dst = path.join(make_outdir(str(tmp_path), 'jpeg'), 'track.mp3')
+    trk.Export(dst, 'radio', 'skip', None)
+    tags = slim.load_tags(dst)
+    for k in ['title', 'album', 'artist', 'albumartist']:
+        assert tags[k] == TAGS[k]
+    assert tags['tracknumber'] == 1
+    assert tags['date'] == TAGS['date']
+    assert TAGS['comment'] in tags['comment']
+    assert slim.get_source_file_checksum(dst)['checksum'] == trk.file_checksum['checksum']